@@ -1,14 +1,17 @@
 # coding: utf8
 
 from __future__ import unicode_literals
+import base64
 import ckan.authz as authz
 from ckan.common import _
 from ckan.common import config
 
 from ckan.lib.mailer import mail_recipient
 from ckan.lib.mailer import MailerException
+import ckan.lib.munge as munge
 import ckan.logic
 import ckan.model as model
+import ckan.plugins.toolkit as toolkit
 from ckan.logic.action.create import user_create
 from ckan.logic.action.get import package_search
 from ckan.logic.action.get import package_show
@@ -16,9 +19,14 @@ from ckan.logic.action.get import resource_search
 from ckan.logic.action.get import resource_view_list
 from ckan.logic import side_effect_free
 from ckanext.initiatives import auth
+from ckanext.initiatives import explain
+from ckanext.initiatives import invalidation
 from ckanext.initiatives import logic
+from ckanext.initiatives import shadow
+from ckanext.initiatives import warmup
 
 from logging import getLogger
+from sqlalchemy import tuple_
 
 log = getLogger(__name__)
 
@@ -27,6 +35,9 @@ _get_or_bust = ckan.logic.get_or_bust
 
 NotFound = ckan.logic.NotFound
 
+ACCESSIBLE_RESOURCES_DEFAULT_LIMIT = 1000
+ACCESSIBLE_RESOURCES_MAX_LIMIT = 10000
+
 
 @side_effect_free
 def initiatives_resource_view_list(context, data_dict):
@@ -79,3 +90,258 @@ def initiatives_check_access(context, data_dict):
     return logic.initiatives_check_user_resource_access(
         user_name, resource_dict, package_dict
     )
+
+
+def _encode_cursor(package_id, resource_id):
+    cursor = "%s/%s" % (package_id, resource_id)
+    return base64.urlsafe_b64encode(cursor.encode("utf8")).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    try:
+        package_id, resource_id = (
+            base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf8").split("/")
+        )
+    except (AttributeError, TypeError, ValueError):
+        raise ckan.logic.ValidationError("Invalid cursor")
+    return package_id, resource_id
+
+
+def _resource_url(package_id, resource_id, url, url_type):
+    # as resource_dictize does for uploaded files
+    if url_type == "upload":
+        return toolkit.url_for(
+            "resource.download",
+            id=package_id,
+            resource_id=resource_id,
+            filename=munge.munge_filename(url.rsplit("/")[-1]),
+            qualified=True,
+        )
+    return url
+
+
+def _package_access(context, user_name, package, extras):
+    # a fresh context for each package: the auth functions cache the package
+    # they look up in the context
+    package_context = {
+        "model": model,
+        "user": context.get("user"),
+        "auth_user_obj": context.get("auth_user_obj"),
+        "package": package,
+    }
+    if not authz.is_authorized(
+        "package_show", package_context, {"id": package.id}
+    ).get("success"):
+        return False
+    return logic.initiatives_check_user_package_access(
+        user_name, logic.initiatives_package_policy_dict(package, extras)
+    ).get("success", False)
+
+
+@side_effect_free
+def initiatives_accessible_resources(context, data_dict):
+    """
+    list the resources the user may download, in keyset order.
+
+    :param cursor: the cursor returned with the previous page (optional)
+    :param limit: the number of resources to examine (optional, default 1000)
+
+    returns the accessible resources among the next `limit` resources, and the
+    cursor for the following page, or None once every resource has been
+    examined. A page can hold fewer than `limit` resources, or none at all,
+    when the user cannot access some of those examined.
+    """
+    try:
+        limit = int(data_dict.get("limit", ACCESSIBLE_RESOURCES_DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        raise ckan.logic.ValidationError("Invalid limit")
+    if limit < 1 or limit > ACCESSIBLE_RESOURCES_MAX_LIMIT:
+        raise ckan.logic.ValidationError(
+            "limit must be between 1 and %d" % ACCESSIBLE_RESOURCES_MAX_LIMIT
+        )
+
+    user_name = logic.initiatives_get_username_from_context(context)
+
+    query = (
+        model.Session.query(
+            model.Resource.package_id,
+            model.Resource.id,
+            model.Resource.url,
+            model.Resource.url_type,
+        )
+        .join(model.Package, model.Package.id == model.Resource.package_id)
+        .filter(model.Package.state == "active")
+        .filter(model.Resource.state == "active")
+        .order_by(model.Resource.package_id, model.Resource.id)
+    )
+    cursor = data_dict.get("cursor")
+    if cursor:
+        query = query.filter(
+            tuple_(model.Resource.package_id, model.Resource.id)
+            > tuple_(*_decode_cursor(cursor))
+        )
+    rows = query.limit(limit).all()
+
+    package_ids = set(row.package_id for row in rows)
+    packages = {}
+    extras = {}
+    if package_ids:
+        packages = {
+            package.id: package
+            for package in model.Session.query(model.Package).filter(
+                model.Package.id.in_(package_ids)
+            )
+        }
+        extras = logic.initiatives_packages_extras(package_ids)
+    with logic.membership_scope():
+        access = {
+            package_id: _package_access(
+                context, user_name, package, extras.get(package_id, {})
+            )
+            for package_id, package in packages.items()
+        }
+
+    resources = [
+        {
+            "id": row.id,
+            "package_id": row.package_id,
+            "url": _resource_url(row.package_id, row.id, row.url, row.url_type),
+        }
+        for row in rows
+        if access.get(row.package_id)
+    ]
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = _encode_cursor(rows[-1].package_id, rows[-1].id)
+
+    return {"resources": resources, "cursor": next_cursor}
+
+
+@side_effect_free
+def initiatives_shadow_report(context, data_dict):
+    """
+    decisions compared in shadow mode: for each optimized path, how many were
+    compared, how many disagreed with the reference evaluator and the mean
+    time each took, with the most recent mismatches
+    """
+    ckan.logic.check_access("initiatives_shadow_report", context, data_dict)
+
+    return shadow.stats.report()
+
+
+@side_effect_free
+def initiatives_explain_access(context, data_dict):
+    """
+    the steps by which the access decision for a user and resource is made,
+    each with its wall time, SQL statement count and cache hits or misses
+
+    :param resource_id: the resource
+    :param user: the name or id of the user (optional, anonymous if omitted)
+    """
+    ckan.logic.check_access("initiatives_explain_access", context, data_dict)
+
+    resource_id = _get_or_bust(data_dict, "resource_id")
+    resource = model.Resource.get(resource_id)
+    if not resource:
+        raise NotFound("Resource not found")
+
+    user_name = ""
+    if data_dict.get("user"):
+        user = model.User.get(data_dict["user"])
+        if not user:
+            raise NotFound("User not found")
+        user_name = user.name
+
+    package = model.Package.get(resource.package_id)
+
+    return explain.explain_access(user_name, resource.as_dict(), package.as_dict())
+
+
+@side_effect_free
+def initiatives_warmup_status(context, data_dict):
+    """
+    whether the cache warm-up started with the app has finished; `ready` is
+    true once there is nothing left to wait for. Sysadmins are also told what
+    each of its steps did, and why it failed.
+    """
+    status = warmup.status()
+    try:
+        ckan.logic.check_access("initiatives_warmup_status", context, data_dict)
+    except ckan.logic.NotAuthorized:
+        return {"state": status["state"], "ready": status["ready"]}
+    return status
+
+
+@side_effect_free
+def initiatives_invalidation_status(context, data_dict):
+    """
+    how many cache invalidations this worker has published and received from
+    the other workers, and how long the received ones took to arrive
+    """
+    ckan.logic.check_access("initiatives_invalidation_status", context, data_dict)
+
+    return invalidation.stats()
+
+
+def _memberships_changed(data_dict):
+    object_type = data_dict.get("object_type")
+    if object_type == "user":
+        user = model.User.get(data_dict.get("object"))
+        if user:
+            invalidation.publish("user", user.name)
+    elif object_type == "group":
+        # an organization's parents changed
+        invalidation.publish("organizations")
+
+
+@side_effect_free
+@toolkit.chained_action
+def initiatives_package_search(original_action, context, data_dict):
+    with logic.search_context(context):
+        return original_action(context, data_dict)
+
+
+@side_effect_free
+@toolkit.chained_action
+def initiatives_resource_show(original_action, context, data_dict):
+    # the package_show made within is not shown to anyone: its decisions
+    # would only be made, and audited, a second time
+    context[logic.SKIP_ANNOTATION] = True
+    try:
+        return original_action(context, data_dict)
+    finally:
+        context.pop(logic.SKIP_ANNOTATION, None)
+
+
+@toolkit.chained_action
+def initiatives_package_create(original_action, context, data_dict):
+    logic.strip_annotations(data_dict)
+    return original_action(context, data_dict)
+
+
+@toolkit.chained_action
+def initiatives_package_update(original_action, context, data_dict):
+    # resource_create and resource_update save through package_update
+    logic.strip_annotations(data_dict)
+    return original_action(context, data_dict)
+
+
+@toolkit.chained_action
+def initiatives_package_patch(original_action, context, data_dict):
+    logic.strip_annotations(data_dict)
+    return original_action(context, data_dict)
+
+
+@toolkit.chained_action
+def initiatives_member_create(original_action, context, data_dict):
+    result = original_action(context, data_dict)
+    _memberships_changed(data_dict)
+    return result
+
+
+@toolkit.chained_action
+def initiatives_member_delete(original_action, context, data_dict):
+    result = original_action(context, data_dict)
+    _memberships_changed(data_dict)
+    return result
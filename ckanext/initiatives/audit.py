@@ -0,0 +1,163 @@
+# coding: utf8
+
+from __future__ import unicode_literals
+import atexit
+import contextlib
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import random
+import threading
+
+from six.moves import queue
+
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+# config options
+#
+#   ckanext.initiatives.audit.path            JSONL file to write; auditing is
+#                                             off unless this is set
+#   ckanext.initiatives.audit.sample_rate.granted
+#   ckanext.initiatives.audit.sample_rate.denied
+#                                             fraction of decisions with that
+#                                             outcome to record (default 1.0)
+#   ckanext.initiatives.audit.queue_size      decisions waiting to be written
+#                                             before further ones are dropped
+#                                             (default 10000)
+#
+# Every worker process appends to the same file, so it is not rotated here:
+# rotate it externally (e.g. logrotate), and each worker reopens the file
+# once it has been moved.
+
+AUDIT_PREFIX = "ckanext.initiatives.audit."
+
+
+class _JSONLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.audit_entry, sort_keys=True)
+
+
+class AuditLog(object):
+    """
+    Access decisions are sampled and queued in the request thread, then
+    serialised and written by a background thread, so that the request only
+    pays for a random() call and a queue put.
+
+    The queue and the writer thread belong to the process which started
+    them: a worker forked from it starts its own on its first decision.
+    """
+
+    def __init__(self, path, sample_rates, queue_size=10000):
+        self.path = path
+        self.sample_rates = sample_rates
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # what a parent process left behind has no writer thread here
+            self.queue = queue.Queue(self.queue_size)
+            handler = logging.handlers.WatchedFileHandler(self.path, encoding="utf8")
+            handler.setFormatter(_JSONLineFormatter())
+            self.listener = logging.handlers.QueueListener(self.queue, handler)
+            self.listener.start()
+            self._pid = os.getpid()
+
+    def record(self, user, resource_dict, package_dict, policy, result, latency):
+        outcome = "granted" if result.get("success") else "denied"
+        if random.random() >= self.sample_rates.get(outcome, 1.0):
+            return
+        self._ensure_started()
+
+        record = logging.makeLogRecord({"msg": "", "levelno": logging.INFO})
+        record.audit_entry = {
+            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "user": user or None,
+            "resource_id": resource_dict.get("id"),
+            "package_id": package_dict.get("id") or resource_dict.get("package_id"),
+            "policy": policy,
+            "outcome": outcome,
+            "reason": result.get("reason"),
+            "latency_ms": round(latency * 1000.0, 3),
+        }
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # never hold up a request waiting for the writer
+            self.dropped += 1
+
+    def stop(self):
+        # writes out everything still queued
+        if self._pid == os.getpid():
+            self.listener.stop()
+            self._pid = None
+
+
+_audit_log = None
+
+
+def configure(config):
+    global _audit_log
+
+    if _audit_log is not None:
+        _audit_log.stop()
+        _audit_log = None
+
+    path = config.get(AUDIT_PREFIX + "path")
+    if not path:
+        return
+
+    sample_rates = {
+        outcome: float(config.get(AUDIT_PREFIX + "sample_rate." + outcome, 1.0))
+        for outcome in ("granted", "denied")
+    }
+    _audit_log = AuditLog(
+        path,
+        sample_rates,
+        queue_size=int(config.get(AUDIT_PREFIX + "queue_size", 10000)),
+    )
+    log.info("auditing access decisions to %s", path)
+
+
+_suppressed = threading.local()
+
+
+@contextlib.contextmanager
+def suppressed():
+    """
+    decisions made within the block, in this thread, are not audited
+    """
+    outer = getattr(_suppressed, "active", False)
+    _suppressed.active = True
+    try:
+        yield
+    finally:
+        _suppressed.active = outer
+
+
+def record(user, resource_dict, package_dict, policy, result, latency):
+    if _audit_log is not None and not getattr(_suppressed, "active", False):
+        _audit_log.record(user, resource_dict, package_dict, policy, result, latency)
+
+
+def stop():
+    global _audit_log
+
+    if _audit_log is not None:
+        _audit_log.stop()
+        _audit_log = None
+
+
+atexit.register(stop)
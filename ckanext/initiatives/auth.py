@@ -1,10 +1,11 @@
 # coding: utf8
 
 from __future__ import unicode_literals
+import timeit
 import ckan.authz as authz
 import ckan.logic.auth as logic_auth
 import ckan.plugins.toolkit as toolkit
-from ckanext.initiatives import logic
+from ckanext.initiatives import audit, cache, logic, shadow
 
 from logging import getLogger
 
@@ -20,18 +21,117 @@ def initiatives_resource_show(context, data_dict=None):
     if not isinstance(resource, dict):
         resource = resource.as_dict()
 
+    start = timeit.default_timer()
+    user_name = logic.initiatives_get_username_from_context(context)
+    package_id = resource.get("package_id")
+
+    # anonymous users (crawlers, mostly) get the same decision for every
+    # resource of a package, until the package changes or its embargo lifts
+    if not user_name:
+        return _cached_decision(
+            cache.anonymous_decisions,
+            package_id,
+            "anonymous_cache",
+            context,
+            data_dict,
+            user_name,
+            resource,
+            start,
+        )
+
     # Ensure user who can edit the package can see the resource
-    if authz.is_authorized(
-        "package_update", context, {"id": resource.get("package_id")}
-    ).get("success"):
+    if authz.is_authorized("package_update", context, {"id": package_id}).get(
+        "success"
+    ):
+        audit.record(
+            user_name,
+            resource,
+            {"id": package_id},
+            None,
+            logic.access_granted(None, "package_editor"),
+            timeit.default_timer() - start,
+        )
         return {"success": True}
 
-    user_name = logic.initiatives_get_username_from_context(context)
+    # other users' decisions, if kept, last until the package or their
+    # memberships change, or the package's embargo lifts
+    return _cached_decision(
+        cache.user_decisions,
+        (user_name, package_id),
+        "decision_cache",
+        context,
+        data_dict,
+        user_name,
+        resource,
+        start,
+    )
+
+
+def _cached_decision(
+    decisions, key, path, context, data_dict, user_name, resource, start
+):
+    details = {
+        "user": user_name,
+        "resource_id": resource.get("id"),
+        "package_id": resource.get("package_id"),
+    }
+    cached = decisions.get(key)
+    if cached is not None:
+
+        def from_cache():
+            audit.record(
+                user_name,
+                resource,
+                {"id": resource.get("package_id")},
+                None,
+                cached,
+                timeit.default_timer() - start,
+            )
+            return dict(cached)
 
+        return shadow.compare(
+            path,
+            lambda: _check_resource_access(context, data_dict, user_name, resource)[0],
+            from_cache,
+            details,
+        )
+
+    # a miss is shadowed as well: the optimized evaluation resolves
+    # memberships through the membership index or cache
+    expiry = []
+
+    def evaluate():
+        decision, expires_at = _check_resource_access(
+            context, data_dict, user_name, resource
+        )
+        expiry.append(expires_at)
+        return decision
+
+    decision = shadow.compare(path + "_miss", evaluate, evaluate, details)
+    decisions.set(key, dict(decision), expiry[0])
+    return decision
+
+
+def _check_resource_access(context, data_dict, user_name, resource):
+    """
+    the decision, and when it expires: the time the package's embargo lifts,
+    or None
+    """
     package = data_dict.get("package", {})
     if not package:
         model = context["model"]
         package = model.Package.get(resource.get("package_id"))
         package = package.as_dict()
 
-    return logic.initiatives_check_user_resource_access(user_name, resource, package)
+    # taken before deciding, so that a decision made just before the embargo
+    # lifts is never kept past it
+    expires_at = logic.embargo_expiry(package)
+    return (
+        logic.initiatives_check_user_resource_access(user_name, resource, package),
+        expires_at,
+    )
+
+
+def initiatives_sysadmin_only(context, data_dict=None):
+    # sysadmins are authorized before auth functions are called
+    return {"success": False, "msg": "Only sysadmins may use this action"}
@@ -0,0 +1,215 @@
+# coding: utf8
+
+from __future__ import unicode_literals
+import datetime
+import threading
+import time
+
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+# config options
+#
+#   ckanext.initiatives.anonymous_cache.ttl    seconds an anonymous user's
+#                                              decision for a package is kept
+#                                              (default 0, off; without the
+#                                              redis invalidation bus, other
+#                                              workers keep stale decisions
+#                                              for up to this long)
+#   ckanext.initiatives.anonymous_cache.size   packages kept (default 50000)
+#   ckanext.initiatives.membership_cache.ttl   seconds a user's resolved
+#                                              memberships are kept (default
+#                                              0, off)
+#   ckanext.initiatives.membership_cache.size  users kept (default 20000)
+#   ckanext.initiatives.decision_cache.ttl     seconds a logged in user's
+#                                              decision for a package is kept
+#                                              (default 0, off); decisions for
+#                                              embargoed packages expire when
+#                                              the embargo lifts, if sooner
+#   ckanext.initiatives.decision_cache.size    decisions kept (default 100000)
+
+CACHE_PREFIX = "ckanext.initiatives."
+
+
+def date_to_timestamp(date):
+    """
+    the timestamp of midnight (local time) at the start of `date`, which is
+    when `datetime.date.today()` first returns it
+    """
+    # converted in the local time zone as it will be then, so that a DST
+    # change in between does not move it
+    midnight = datetime.datetime.combine(date, datetime.time())
+    return time.mktime(midnight.timetuple())
+
+
+class ExpiringCache(object):
+    """
+    A thread-safe mapping whose entries expire, each at its own absolute time
+    (but never more than `ttl` seconds after being stored). When full, the
+    oldest entry is evicted.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() >= entry[1]:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key):
+        """
+        the entry's value and expiry, or None, without counting a hit or miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or time.time() >= entry[1]:
+            return None
+        return entry
+
+    def set(self, key, value, expires_at=None):
+        if self.ttl <= 0:
+            return
+        expiry = time.time() + self.ttl
+        if expires_at is not None:
+            expiry = min(expiry, expires_at)
+
+        with self._lock:
+            self._entries.pop(key, None)
+            while self._entries and len(self._entries) >= self.max_entries:
+                # entries are kept in insertion order
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (value, expiry)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """
+        drop the entries whose keys satisfy `predicate`, looking at them all
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the
+    function while the others wait for it to finish and share its result, or
+    its exception. Nothing is kept once the call finishes, so it can sit
+    beneath any cache (or none).
+
+    Only threading primitives are used, so under gevent (with the standard
+    library monkey patched) waiting greenlets yield rather than block.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+
+# decisions for anonymous users, by package id: they depend only on the
+# package's policy and the date
+anonymous_decisions = ExpiringCache(0, 50000)
+
+# UserOrganizations, by user name
+memberships = ExpiringCache(0, 20000)
+
+# decisions for logged in users, by (user name, package id): they depend on
+# the package's policy, the user's memberships and the date
+user_decisions = ExpiringCache(0, 100000)
+
+
+def configure(config):
+    anonymous_decisions.ttl = int(
+        config.get(CACHE_PREFIX + "anonymous_cache.ttl", 0)
+    )
+    anonymous_decisions.max_entries = int(
+        config.get(CACHE_PREFIX + "anonymous_cache.size", 50000)
+    )
+    anonymous_decisions.clear()
+    memberships.ttl = int(config.get(CACHE_PREFIX + "membership_cache.ttl", 0))
+    memberships.max_entries = int(
+        config.get(CACHE_PREFIX + "membership_cache.size", 20000)
+    )
+    memberships.clear()
+    user_decisions.ttl = int(config.get(CACHE_PREFIX + "decision_cache.ttl", 0))
+    user_decisions.max_entries = int(
+        config.get(CACHE_PREFIX + "decision_cache.size", 100000)
+    )
+    user_decisions.clear()
+
+
+def invalidate_package(package_id):
+    invalidate_packages([package_id])
+
+
+def invalidate_packages(package_ids):
+    package_ids = set(package_ids)
+    for package_id in package_ids:
+        anonymous_decisions.invalidate(package_id)
+    if len(user_decisions):
+        user_decisions.invalidate_where(lambda key: key[1] in package_ids)
+
+
+def invalidate_user(user_name):
+    memberships.invalidate(user_name)
+    if len(user_decisions):
+        user_decisions.invalidate_where(lambda key: key[0] == user_name)
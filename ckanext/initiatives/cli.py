@@ -0,0 +1,197 @@
+# coding: utf8
+
+from __future__ import unicode_literals
+import datetime
+import timeit
+
+import click
+
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+from ckan.lib import search
+from ckanext.initiatives import invalidation, logic
+
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+@click.group()
+def initiatives():
+    """
+    ckanext-initiatives commands
+    """
+
+
+def _organization_id(org_id_or_name):
+    organization = model.Group.get(org_id_or_name)
+    if organization is None or not organization.is_organization:
+        raise click.BadParameter(
+            "no such organization: %s" % org_id_or_name, param_hint="--organization"
+        )
+    return organization.id
+
+
+def _select_package_ids(organization_id, query, rows=1000):
+    if not query:
+        return [
+            package_id
+            for (package_id,) in model.Session.query(model.Package.id)
+            .filter(model.Package.owner_org == organization_id)
+            .filter(model.Package.state == "active")
+            .order_by(model.Package.id)
+        ]
+
+    data_dict = {
+        "q": query,
+        "fl": "id",
+        "rows": rows,
+        "include_private": True,
+    }
+    if organization_id:
+        data_dict["fq"] = "owner_org:%s" % organization_id
+    package_search = toolkit.get_action("package_search")
+    package_ids = []
+    while True:
+        data_dict["start"] = len(package_ids)
+        results = package_search({"ignore_auth": True}, dict(data_dict))["results"]
+        package_ids.extend(result["id"] for result in results)
+        if len(results) < rows:
+            return package_ids
+
+
+def _set_extras(package_ids, extras):
+    """
+    insert or update the packages' extras, and bump their metadata_modified,
+    in one transaction
+    """
+    existing = (
+        model.Session.query(model.PackageExtra)
+        .filter(model.PackageExtra.package_id.in_(package_ids))
+        .filter(model.PackageExtra.key.in_(list(extras)))
+    )
+    missing = set((package_id, key) for package_id in package_ids for key in extras)
+    for extra in existing:
+        extra.value = extras[extra.key]
+        if hasattr(extra, "state"):
+            extra.state = "active"
+        missing.discard((extra.package_id, extra.key))
+    for package_id, key in sorted(missing):
+        model.Session.add(
+            model.PackageExtra(package_id=package_id, key=key, value=extras[key])
+        )
+
+    model.Session.query(model.Package).filter(
+        model.Package.id.in_(package_ids)
+    ).update(
+        {"metadata_modified": datetime.datetime.utcnow()}, synchronize_session=False
+    )
+    model.Session.commit()
+
+
+def _reindex(package_ids):
+    search.rebuild(package_ids=package_ids, defer_commit=True)
+    search.commit()
+
+
+@initiatives.command("set-policy")
+@click.argument("policy")
+@click.option(
+    "-o", "--organization", help="the packages owned by this organization"
+)
+@click.option("-q", "--query", help="the packages matching this search query")
+@click.option(
+    "--embargo-date",
+    help="also set the policy's embargo field to this date (YYYY-MM-DD)",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=500,
+    show_default=True,
+    help="packages updated in each transaction",
+)
+@click.option("--dry-run", is_flag=True, help="only count the packages")
+def set_policy(policy, organization, query, embargo_date, batch_size, dry_run):
+    """
+    set the resource_permissions policy of many packages at once, without a
+    package_patch per package: their extras are updated in batches, and they
+    are reindexed together with a single search commit
+    """
+    if not organization and not query:
+        raise click.UsageError("give an --organization, a --query or both")
+    try:
+        name, args = logic.validate_resource_permissions(policy)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="POLICY")
+
+    extras = {"resource_permissions": policy}
+    if embargo_date:
+        if logic.PERMISSION_HANDLERS[name] is not logic.apply_access_after:
+            raise click.BadParameter(
+                "the policy has no embargo field", param_hint="--embargo-date"
+            )
+        try:
+            datetime.datetime.strptime(embargo_date, "%Y-%m-%d")
+        except ValueError:
+            raise click.BadParameter(
+                "expected YYYY-MM-DD, got %s" % embargo_date,
+                param_hint="--embargo-date",
+            )
+        extras[args[0]] = embargo_date
+
+    organization_id = _organization_id(organization) if organization else None
+    package_ids = _select_package_ids(organization_id, query)
+    click.echo("packages selected: %d" % len(package_ids))
+    if dry_run or not package_ids:
+        return
+
+    if invalidation.other_workers_stale():
+        click.echo(
+            "warning: only this command's caches are invalidated; the web "
+            "workers keep their cached decisions for these packages until they "
+            "expire (set ckanext.initiatives.invalidation.bus = redis)",
+            err=True,
+        )
+
+    start = timeit.default_timer()
+    committed = []
+    try:
+        for offset in range(0, len(package_ids), batch_size):
+            batch = package_ids[offset : offset + batch_size]
+            try:
+                _set_extras(batch, extras)
+            except Exception:
+                model.Session.rollback()
+                raise
+            committed.extend(batch)
+            invalidation.publish("packages", batch)
+            click.echo("updated %d of %d" % (len(committed), len(package_ids)))
+    except Exception:
+        # the batches already committed are still reindexed, so that search
+        # agrees with the database
+        click.echo(
+            "failed after updating %d of %d packages"
+            % (len(committed), len(package_ids)),
+            err=True,
+        )
+        if committed:
+            try:
+                _reindex(committed)
+            except Exception:
+                log.exception(
+                    "could not reindex the %d packages updated", len(committed)
+                )
+        # the batch's error, not the reindex's
+        raise
+    updated = timeit.default_timer()
+
+    _reindex(package_ids)
+    click.echo(
+        "updated in %.1fs, reindexed in %.1fs"
+        % (updated - start, timeit.default_timer() - updated)
+    )
+
+
+def get_commands():
+    return [initiatives]
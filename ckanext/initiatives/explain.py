@@ -0,0 +1,176 @@
+# coding: utf8
+
+from __future__ import unicode_literals
+import contextlib
+import threading
+import time
+import timeit
+
+import ckan.authz as authz
+import ckan.model as model
+from ckanext.initiatives import audit, cache, hierarchy, logic
+from sqlalchemy import event
+
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+_statements = threading.local()
+_listening = set()
+_listening_lock = threading.Lock()
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_statements, "count", None) is not None:
+        _statements.count += 1
+
+
+def _listen(engine):
+    # once per engine; the listener only counts in threads being traced
+    with _listening_lock:
+        if engine is not None and id(engine) not in _listening:
+            event.listen(engine, "before_cursor_execute", _count_statement)
+            _listening.add(id(engine))
+
+
+class Trace(object):
+    """
+    The steps of an access decision, each with its wall time and the number
+    of SQL statements it ran
+    """
+
+    def __init__(self):
+        self.steps = []
+
+    @contextlib.contextmanager
+    def step(self, name):
+        info = {"step": name}
+        statements = _statements.count
+        start = timeit.default_timer()
+        try:
+            yield info
+        finally:
+            info["wall_ms"] = round((timeit.default_timer() - start) * 1000.0, 3)
+            info["sql_statements"] = _statements.count - statements
+            self.steps.append(info)
+
+
+@contextlib.contextmanager
+def _tracing():
+    _listen(model.Session.get_bind())
+    _statements.count = 0
+    try:
+        yield Trace()
+    finally:
+        _statements.count = None
+
+
+def _hit(hit):
+    return "hit" if hit else "miss"
+
+
+def _cached(trace, decisions, key):
+    with trace.step("decision_cache") as info:
+        info["cache"] = (
+            "anonymous_decisions" if decisions is cache.anonymous_decisions
+            else "user_decisions"
+        )
+        info["enabled"] = decisions.ttl > 0
+        entry = decisions.peek(key)
+        info["result"] = _hit(entry is not None)
+        if entry is not None:
+            info["cached"] = entry[0]
+            info["expires_at"] = entry[1]
+    return dict(entry[0]) if entry is not None else None
+
+
+def explain_access(user_name, resource_dict, package_dict):
+    """
+    make the decision the resource_show auth function would make for the
+    user, recording each step: the decision it would serve (from a cache,
+    if there is one there) and the decision evaluated afresh. Nothing is
+    audited.
+    """
+    package_id = package_dict.get("id")
+
+    with _tracing() as trace, audit.suppressed(), logic.membership_scope():
+        start = timeit.default_timer()
+        decision = None
+        cached = None
+
+        if not user_name:
+            cached = _cached(trace, cache.anonymous_decisions, package_id)
+        else:
+            with trace.step("package_update_check") as info:
+                editor = authz.is_authorized(
+                    "package_update",
+                    {"model": model, "user": user_name},
+                    {"id": package_id},
+                ).get("success")
+                info["result"] = editor
+            if editor:
+                decision = logic.access_granted(None, "package_editor")
+            else:
+                cached = _cached(
+                    trace, cache.user_decisions, (user_name, package_id)
+                )
+
+        if decision is None:
+            with trace.step("policy_parse") as info:
+                own_policy = logic.get_key_maybe_extras(
+                    package_dict, "resource_permissions"
+                )
+                info["inherited"] = not own_policy
+                cache_info = {}
+                if not own_policy:
+                    cache_info["organization_hierarchy"] = _hit(
+                        hierarchy.organizations.loaded()
+                    )
+                policy = logic.get_resource_permissions(package_dict)
+                hits = logic.compile_resource_permissions.cache_info().hits
+                logic.compile_resource_permissions(policy)
+                cache_info["compiled_policy"] = _hit(
+                    logic.compile_resource_permissions.cache_info().hits > hits
+                )
+                name, args = logic.split_resource_permissions(policy)
+                info.update(policy=policy, handler=name, args=args, cache=cache_info)
+
+            with trace.step("membership_resolution") as info:
+                if user_name:
+                    resolving = time.time()
+                    user_orgs = logic.get_user_organizations(user_name)
+                    miss = user_orgs.resolved_at >= resolving
+                    info["cache"] = _hit(not miss)
+                    info["organization_show_calls"] = (
+                        user_orgs.organization_show_calls if miss else 0
+                    )
+                    info["org_names"] = sorted(user_orgs.org_names)
+                else:
+                    info["skipped"] = "anonymous user"
+
+            with trace.step("date_parsing") as info:
+                lift_date = logic.embargo_lift_date(package_dict)
+                info["lift_date"] = lift_date.isoformat() if lift_date else None
+                info["embargo_state"] = logic.embargo_state(package_dict)
+
+            with trace.step("handler") as info:
+                decision = logic.initiatives_check_user_resource_access(
+                    user_name, resource_dict, package_dict
+                )
+                info["result"] = decision
+
+        total_ms = round((timeit.default_timer() - start) * 1000.0, 3)
+
+    return {
+        "user": user_name,
+        "resource_id": resource_dict.get("id"),
+        "package_id": package_id,
+        "steps": trace.steps,
+        # what resource_show would serve
+        "decision": cached if cached is not None else decision,
+        "served_from": "cache" if cached is not None else "evaluation",
+        "evaluated_decision": decision,
+        "total_ms": total_ms,
+        "sql_statements": sum(step["sql_statements"] for step in trace.steps),
+    }
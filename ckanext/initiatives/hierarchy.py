@@ -0,0 +1,152 @@
+# coding: utf8
+
+from __future__ import unicode_literals
+import threading
+import time
+
+import ckan.model as model
+from ckanext.initiatives import cache
+
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+# config options
+#
+#   ckanext.initiatives.hierarchy_cache.ttl    seconds the organization
+#                                              hierarchy is kept before being
+#                                              loaded again (default 600;
+#                                              without the redis invalidation
+#                                              bus, other workers keep old
+#                                              default policies for up to
+#                                              this long)
+
+HIERARCHY_PREFIX = "ckanext.initiatives.hierarchy_cache."
+
+# the organization extra holding the default policy for its packages
+DEFAULT_POLICY_KEY = "resource_permissions"
+
+
+class _Index(object):
+    def __init__(self):
+        self.ids = {}
+        self.names = {}
+        self.policies = {}
+        self.parents = {}
+
+
+class OrganizationHierarchy(object):
+    """
+    Every active organization's name, default policy and parents, loaded with
+    three queries and kept until invalidated or `ttl` seconds old
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._index = None
+        self._loaded_at = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._loads = cache.SingleFlight()
+
+    def _load(self):
+        index = _Index()
+
+        organizations = (
+            model.Session.query(model.Group.id, model.Group.name)
+            .filter(model.Group.is_organization == True)
+            .filter(model.Group.state == "active")
+        )
+        for org_id, org_name in organizations:
+            index.ids[org_name] = org_id
+            index.names[org_id] = org_name
+
+        policies = (
+            model.Session.query(model.GroupExtra.group_id, model.GroupExtra.value)
+            .filter(model.GroupExtra.key == DEFAULT_POLICY_KEY)
+            .filter(model.GroupExtra.state == "active")
+        )
+        for org_id, policy in policies:
+            if policy:
+                index.policies[org_id] = policy
+
+        # a parent is stored as Member(group_id=<child>, table_id=<parent>),
+        # in whatever capacity group_member_save gave it, as
+        # Group.get_parent_groups (and so organization_show) reads it
+        parents = (
+            model.Session.query(model.Member.group_id, model.Member.table_id)
+            .filter(model.Member.table_name == "group")
+            .filter(model.Member.state == "active")
+        )
+        for child_id, parent_id in parents:
+            index.parents.setdefault(child_id, []).append(parent_id)
+
+        log.debug("loaded hierarchy of %d organizations", len(index.names))
+        return index
+
+    def index(self):
+        with self._lock:
+            index = self._index
+            if index is not None and time.time() - self._loaded_at < self.ttl:
+                return index
+            generation = self._generation
+
+        index = self._loads.do("index", self._load)
+        with self._lock:
+            # unless invalidated while loading
+            if self._generation == generation:
+                self._index = index
+                self._loaded_at = time.time()
+        return index
+
+    def loaded(self):
+        """
+        whether the next lookup will be answered without loading
+        """
+        with self._lock:
+            return (
+                self._index is not None
+                and time.time() - self._loaded_at < self.ttl
+            )
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._generation += 1
+
+    def org_id(self, org_id_or_name):
+        index = self.index()
+        if org_id_or_name in index.names:
+            return org_id_or_name
+        return index.ids.get(org_id_or_name)
+
+    def parent_ids(self, org_id_or_name):
+        return list(self.index().parents.get(self.org_id(org_id_or_name), []))
+
+    def default_policy(self, org_id_or_name):
+        """
+        the organization's default policy or, failing that, the nearest one
+        among its parents (breadth first), or "" if there is none
+        """
+        index = self.index()
+        pending = [self.org_id(org_id_or_name)]
+        seen = set()
+        while pending:
+            org_id = pending.pop(0)
+            if org_id is None or org_id in seen:
+                continue
+            seen.add(org_id)
+            policy = index.policies.get(org_id)
+            if policy:
+                return policy
+            pending.extend(index.parents.get(org_id, []))
+        return ""
+
+
+organizations = OrganizationHierarchy(600)
+
+
+def configure(config):
+    organizations.ttl = int(config.get(HIERARCHY_PREFIX + "ttl", 600))
+    organizations.invalidate()
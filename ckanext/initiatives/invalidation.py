@@ -0,0 +1,277 @@
+# coding: utf8
+
+from __future__ import unicode_literals
+import json
+import os
+import threading
+import time
+import uuid
+
+import ckan.model as model
+from ckanext.initiatives import cache, hierarchy, membership_index
+from sqlalchemy import event
+
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+# config options
+#
+#   ckanext.initiatives.invalidation.bus       "memory" (the default) to only
+#                                              invalidate this process's
+#                                              caches, or "redis" to broadcast
+#                                              invalidations to every worker
+#                                              through CKAN's redis
+#   ckanext.initiatives.invalidation.channel   the redis pub/sub channel
+#                                              (default
+#                                              "ckanext-initiatives:invalidate")
+
+INVALIDATION_PREFIX = "ckanext.initiatives.invalidation."
+
+
+def _invalidate_package(package_id):
+    cache.invalidate_package(package_id)
+
+
+def _invalidate_packages(package_ids):
+    cache.invalidate_packages(package_ids)
+
+
+def _invalidate_user(user_name):
+    cache.invalidate_user(user_name)
+    membership_index.memberships.invalidate()
+
+
+def _invalidate_organizations(key):
+    # memberships, default policies and so any decision may have
+    # changed for any user or package below an organization
+    hierarchy.organizations.invalidate()
+    membership_index.memberships.invalidate()
+    cache.memberships.clear()
+    cache.anonymous_decisions.clear()
+    cache.user_decisions.clear()
+
+
+INVALIDATIONS = {
+    "package": _invalidate_package,
+    # a list of package ids, changed together
+    "packages": _invalidate_packages,
+    "user": _invalidate_user,
+    "organizations": _invalidate_organizations,
+    # everything: e.g. after missing messages
+    "all": _invalidate_organizations,
+}
+
+
+def invalidate(kind, key=None):
+    """
+    drop this process's cached entries affected by a change
+    """
+    INVALIDATIONS[kind](key)
+
+
+class InvalidationBus(object):
+    """
+    Invalidations are applied to this process's caches at once, and sent to
+    the other workers, which apply them as they receive them. The lag of each
+    received invalidation (from when it was sent) is recorded.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self.published = 0
+        self.received = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lag_last = None
+        self._lock = threading.Lock()
+
+    def publish(self, kind, key=None):
+        invalidate(kind, key)
+        self.published += 1
+        self._send(
+            {"kind": kind, "key": key, "sent_at": time.time(), "origin": self.origin}
+        )
+
+    def receive(self, message):
+        if message.get("origin") == self.origin:
+            return
+        if message.get("kind") not in INVALIDATIONS:
+            log.warning("unknown invalidation: %s", message)
+            return
+
+        # across nodes, this relies on their clocks agreeing
+        lag = max(time.time() - message.get("sent_at", time.time()), 0.0)
+        with self._lock:
+            self.received += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            self.lag_last = lag
+        invalidate(message["kind"], message.get("key"))
+
+    def _send(self, message):
+        raise NotImplementedError
+
+    def ensure_subscribed(self):
+        pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bus": self.name,
+                "published": self.published,
+                "received": self.received,
+                "lag_last_ms": None
+                if self.lag_last is None
+                else round(self.lag_last * 1000.0, 3),
+                "lag_max_ms": round(self.lag_max * 1000.0, 3),
+                "lag_mean_ms": round(1000.0 * self.lag_total / self.received, 3)
+                if self.received
+                else None,
+            }
+
+
+class MemoryInvalidationBus(InvalidationBus):
+    """
+    An in-process stand-in: buses sharing a `channel` list deliver to each
+    other, as workers sharing a redis channel would
+    """
+
+    name = "memory"
+
+    def __init__(self, channel=None):
+        super(MemoryInvalidationBus, self).__init__()
+        self.channel = channel if channel is not None else []
+        self.channel.append(self)
+
+    def _send(self, message):
+        for bus in list(self.channel):
+            if bus is not self:
+                bus.receive(dict(message))
+
+
+class RedisInvalidationBus(InvalidationBus):
+    """
+    Broadcasts invalidations on a redis pub/sub channel. Each worker process
+    listens in a thread of its own, started on the first request it handles
+    (so that it survives the fork into workers).
+    """
+
+    name = "redis"
+
+    def __init__(self, channel):
+        super(RedisInvalidationBus, self).__init__()
+        self.channel = channel
+        self._pid = None
+        self._subscribe_lock = threading.Lock()
+
+    def _send(self, message):
+        from ckan.lib.redis import connect_to_redis
+
+        try:
+            connect_to_redis().publish(self.channel, json.dumps(message))
+        except Exception:
+            # the other workers' caches expire in time regardless
+            log.warning("could not publish invalidation %s", message, exc_info=True)
+
+    def ensure_subscribed(self):
+        if self._pid == os.getpid():
+            return
+        with self._subscribe_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(
+                target=self._listen, name="initiatives-invalidation"
+            )
+            thread.daemon = True
+            thread.start()
+
+    def _listen(self):
+        from ckan.lib.redis import connect_to_redis
+
+        subscribed_before = False
+        while True:
+            try:
+                pubsub = connect_to_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                if subscribed_before:
+                    # invalidations sent while disconnected were missed
+                    invalidate("all")
+                subscribed_before = True
+                for item in pubsub.listen():
+                    if item.get("type") == "message":
+                        self.receive(json.loads(item["data"]))
+            except Exception:
+                log.warning("invalidation subscriber failed", exc_info=True)
+                time.sleep(1)
+
+
+bus = MemoryInvalidationBus()
+
+
+def configure(config):
+    global bus
+
+    kind = config.get(INVALIDATION_PREFIX + "bus", "memory")
+    if kind == "redis":
+        bus = RedisInvalidationBus(
+            config.get(INVALIDATION_PREFIX + "channel", "ckanext-initiatives:invalidate")
+        )
+    else:
+        bus = MemoryInvalidationBus()
+
+
+def publish(kind, key=None):
+    bus.publish(kind, key)
+
+
+def other_workers_stale():
+    """
+    whether other processes' caches keep stale entries after a change: they
+    are on, but invalidations only reach this process
+    """
+    return bus.name == "memory" and (
+        cache.anonymous_decisions.ttl > 0
+        or cache.user_decisions.ttl > 0
+        or cache.memberships.ttl > 0
+        or membership_index.memberships.ttl > 0
+        or hierarchy.organizations.ttl > 0
+    )
+
+
+_PENDING = "ckanext.initiatives.invalidations"
+
+
+def publish_after_commit(kind, key=None):
+    """
+    publish now, so that this process stops using the entries at once, and
+    again once the current transaction commits: a decision cached by another
+    request in between would have been made from the old state
+    """
+    publish(kind, key)
+    model.Session().info.setdefault(_PENDING, []).append((kind, key))
+
+
+def _publish_pending(session):
+    for kind, key in session.info.pop(_PENDING, []):
+        publish(kind, key)
+
+
+def _discard_pending(session):
+    session.info.pop(_PENDING, None)
+
+
+event.listen(model.Session, "after_commit", _publish_pending)
+event.listen(model.Session, "after_rollback", _discard_pending)
+
+
+def ensure_subscribed():
+    bus.ensure_subscribed()
+
+
+def stats():
+    return bus.stats()
@@ -9,10 +9,17 @@ from ckan.common import config
 
 import ckan.lib.mailer as mailer
 import ckan.logic as logic
+import ckan.model as model
 import ckan.plugins.toolkit as toolkit
+import contextlib
 import datetime
 import functools
+import hashlib
+import threading
+import time
+import timeit
 
+from ckanext.initiatives import audit, cache, hierarchy, membership_index
 from logging import getLogger
 
 log = getLogger(__name__)
@@ -22,6 +29,7 @@ class UserOrganizations:
     def __init__(self, user):
         self.org_names = set()
         self.org_ids = set()
+        self.organization_show_calls = 0
 
         context = {"user": user}
         data_dict = {"permission": "read"}
@@ -43,6 +51,7 @@ class UserOrganizations:
                 org_show_dict["include_datasets"] = False
                 org_show_dict["include_users"] = False
                 org_show_dict["include_extras"] = True
+                self.organization_show_calls += 1
                 org_with_extras = logic.get_action("organization_show")(context, org_show_dict)
                 if (org_with_extras):
                     for group in org_with_extras["groups"]:
@@ -50,15 +59,165 @@ class UserOrganizations:
                          if parent_name is not None:
                              self.org_names.add(parent_name)
 
+        self.resolved_at = time.time()
+
+
+_membership_lookups = cache.SingleFlight()
+_membership_scope = threading.local()
+
+
+@contextlib.contextmanager
+def membership_scope():
+    """
+    within the block, each user's memberships are resolved at most once, e.g.
+    while checking every package on a page of search results
+    """
+    outer = getattr(_membership_scope, "memberships", None)
+    if outer is None:
+        _membership_scope.memberships = {}
+    try:
+        yield
+    finally:
+        if outer is None:
+            _membership_scope.memberships = None
+
+
+_reference = threading.local()
+
+
+@contextlib.contextmanager
+def reference_evaluation():
+    """
+    within the block, memberships are resolved afresh by UserOrganizations,
+    bypassing any membership scope, the membership index and the membership
+    cache: the reference shadow mode compares optimized paths with, and what
+    the check_access endpoint pairs with its database-derived ETag
+    """
+    outer = getattr(_reference, "active", False)
+    _reference.active = True
+    try:
+        yield
+    finally:
+        _reference.active = outer
+
+
+_search_context = threading.local()
+
+
+@contextlib.contextmanager
+def search_context(context):
+    """
+    the context of the package_search being run, for after_dataset_search,
+    which is not given it
+    """
+    outer = getattr(_search_context, "context", None)
+    _search_context.context = context
+    try:
+        yield
+    finally:
+        _search_context.context = outer
+
+
+def get_search_context():
+    return getattr(_search_context, "context", None)
+
+
+def get_user_organizations(user):
+    """
+    the user's UserOrganizations, from the membership index or the membership
+    cache when they are enabled; concurrent lookups for the same user share
+    a single UserOrganizations
+    """
+    if getattr(_reference, "active", False):
+        return UserOrganizations(user)
+
+    memberships = getattr(_membership_scope, "memberships", None)
+    if memberships is not None and user in memberships:
+        return memberships[user]
+
+    user_orgs = None
+    index = membership_index.memberships.index()
+    if index is not None:
+        user_orgs = index.user_organizations(user)
+    if user_orgs is None:
+        user_orgs = cache.memberships.get(user)
+    if user_orgs is None:
+        user_orgs = _membership_lookups.do(user, lambda: UserOrganizations(user))
+        cache.memberships.set(user, user_orgs)
+    if memberships is not None:
+        memberships[user] = user_orgs
+    return user_orgs
+
+
+def get_user_editable_organizations(user):
+    """
+    the ids of the organizations whose datasets the user may update, resolved
+    at most once within a membership scope
+    """
+    memberships = getattr(_membership_scope, "memberships", None)
+    key = ("update_dataset", user)
+    if memberships is not None and key in memberships:
+        return memberships[key]
+
+    org_ids = set(
+        org["id"]
+        for org in logic.get_action("organization_list_for_user")(
+            {"user": user}, {"permission": "update_dataset"}
+        )
+    )
+    if memberships is not None:
+        memberships[key] = org_ids
+    return org_ids
+
+
+def user_can_edit_package(user, package_dict):
+    """
+    package_update's decision for the user, from the organizations they may
+    update datasets in. Packages without an organization, and collaborators,
+    are left to package_update itself.
+    """
+    if not user:
+        return False
+    owner_org = package_dict.get("owner_org")
+    if owner_org:
+        if owner_org in get_user_editable_organizations(user):
+            return True
+        if not authz.check_config_permission("allow_dataset_collaborators"):
+            return False
+    return authz.is_authorized(
+        "package_update", {"model": model, "user": user}, {"id": package_dict.get("id")}
+    ).get("success")
+
+
 def get_key_maybe_extras(obj, name):
     # scheming may have put the field on 'extras'
     if isinstance(obj.get("extras"), list):
-        extras = {str(k): text_type(v) for k, v in obj.get("extras", [])}
+        extras = {}
+        for extra in obj.get("extras", []):
+            # package_show and package_search give [{"key": k, "value": v}]
+            if isinstance(extra, dict):
+                k, v = extra.get("key"), extra.get("value")
+            else:
+                k, v = extra
+            extras[str(k)] = text_type(v)
     else:
         extras = obj.get("extras", {})
     return obj.get(name, extras.get(name, ""))
 
 
+def get_resource_permissions(package_dict):
+    """
+    the package's own policy string or, failing that, the default policy of
+    its organization or the nearest of that organization's parents
+    """
+    resource_permissions = get_key_maybe_extras(package_dict, "resource_permissions")
+    if not resource_permissions and package_dict.get("owner_org"):
+        resource_permissions = hierarchy.organizations.default_policy(
+            package_dict.get("owner_org")
+        )
+    return resource_permissions
+
+
 def initiatives_get_username_from_context(context):
     auth_user_obj = context.get("auth_user_obj", None)
     user_name = ""
@@ -70,16 +229,18 @@ def initiatives_get_username_from_context(context):
     return user_name
 
 
-def access_granted(organization=None):
+def access_granted(organization=None, reason=None):
     retval = {"success": True}
 
     if organization:
         retval["result"] = organization
+    if reason:
+        retval["reason"] = reason
 
     return retval
 
 
-def access_denied(organization=None):
+def access_denied(organization=None, reason=None):
     # log calling location to assist debugging
     cf = currentframe()
     log.info(
@@ -98,6 +259,8 @@ def access_denied(organization=None):
             "__type": "Access Permissions Error",
             "message": "Unable to determine permissions for access",
         }
+    if reason:
+        retval["reason"] = reason
 
     return retval
 
@@ -107,9 +270,10 @@ def check_extra_args(nargs):
         @functools.wraps(fn)
         def check(u, r, p, *args):
             if len(args) != nargs:
-                return access_denied(None)
+                return access_denied(None, "invalid_arguments")
             return fn(u, r, p, *args)
 
+        check.nargs = nargs
         return check
 
     return decorator_check_args
@@ -119,16 +283,16 @@ def check_extra_args(nargs):
 def apply_organization_member(user, resource_dict, package_dict):
     # must be logged in as a registered user
     if not user:
-        return access_denied(None)
+        return access_denied(None, "not_logged_in")
 
     pkg_organization_id = package_dict.get("owner_org", "")
 
     # check if the user is a full consortium member
-    user_orgs = UserOrganizations(user)
+    user_orgs = get_user_organizations(user)
 
     if pkg_organization_id in user_orgs.org_ids:
-        return access_granted(pkg_organization_id)
-    return access_denied(pkg_organization_id)
+        return access_granted(pkg_organization_id, "organization_member")
+    return access_denied(pkg_organization_id, "not_organization_member")
 
 
 @check_extra_args(3)
@@ -146,12 +310,12 @@ def apply_access_after(
 
     # must be logged in as a registered user
     if not user:
-        return access_denied(None)
+        return access_denied(None, "not_logged_in")
 
     # check if the user is a full consortium member
-    user_orgs = UserOrganizations(user)
+    user_orgs = get_user_organizations(user)
     if consortium_org_name and consortium_org_name in user_orgs.org_names:
-        return access_granted(consortium_org_name)
+        return access_granted(consortium_org_name, "consortium_member")
 
     # check if the data is out of embargo
     try:
@@ -166,7 +330,7 @@ def apply_access_after(
 
     # we can't work out the dates: deny access
     if days is None or dt is None:
-        return access_denied(None)
+        return access_denied(None, "invalid_embargo")
 
     today = datetime.date.today()
     d_days = (today - dt).days
@@ -175,12 +339,12 @@ def apply_access_after(
         return apply_organization_member(user, resource_dict, package_dict)
     else:
         # data in embargo: deny access
-        return access_denied(consortium_org_name)
+        return access_denied(consortium_org_name, "embargoed")
 
 
 @check_extra_args(0)
 def apply_public(user, resource_dict, package_dict):
-    return access_granted()
+    return access_granted(None, "public")
 
 
 PERMISSION_HANDLERS = {
@@ -190,10 +354,12 @@ PERMISSION_HANDLERS = {
 }
 
 
-def parse_resource_permissions(permission_str):
+def split_resource_permissions(permission_str):
     """
     syntax is:
     handler_name:arg1:arg2
+
+    returns the handler name and its arguments
     """
     parts = [t.strip() for t in permission_str.split(":")]
 
@@ -208,17 +374,278 @@ def parse_resource_permissions(permission_str):
     if name not in PERMISSION_HANDLERS:
         name = "organization_member"
 
+    return name, args
+
+
+def validate_resource_permissions(permission_str):
+    """
+    the handler name and arguments of a policy string, as
+    split_resource_permissions, raising ValueError if it names no handler or
+    the wrong number of arguments for it rather than falling back to
+    organization_member
+    """
+    parts = [t.strip() for t in permission_str.split(":")]
+    name, args = parts[0], parts[1:]
+
+    handler = PERMISSION_HANDLERS.get(name)
+    if handler is None:
+        raise ValueError(
+            "unknown handler %r, expected one of: %s"
+            % (name, ", ".join(sorted(PERMISSION_HANDLERS)))
+        )
+    if len(args) != handler.nargs:
+        raise ValueError(
+            "%s takes %d arguments, got %d" % (name, handler.nargs, len(args))
+        )
+    if handler is apply_access_after:
+        try:
+            int(args[1])
+        except ValueError:
+            raise ValueError("embargo days must be a whole number, got %r" % args[1])
+
+    return name, args
+
+
+def parse_resource_permissions(permission_str):
+    name, args = split_resource_permissions(permission_str)
+
     return lambda u, r, p: PERMISSION_HANDLERS[name](u, r, p, *args)
 
 
+@functools.lru_cache(maxsize=1024)
+def compile_resource_permissions(permission_str):
+    """
+    parse_resource_permissions, parsing each distinct policy string only once
+    """
+    return parse_resource_permissions(permission_str)
+
+
+def embargo_lift_date(package_dict):
+    """
+    the date on which an `organization_member_after_embargo` policy stops
+    embargoing the package, or None if the package is not time-bound or the
+    embargo dates cannot be worked out
+    """
+    resource_permissions = get_resource_permissions(package_dict)
+    name, args = split_resource_permissions(resource_permissions)
+    if PERMISSION_HANDLERS[name] is not apply_access_after or len(args) != 3:
+        return None
+
+    field_name, days = args[0], args[1]
+    try:
+        days = int(days)
+    except ValueError:
+        return None
+    dt_str = get_key_maybe_extras(package_dict, field_name)
+    try:
+        dt = datetime.datetime.strptime(dt_str, "%Y-%m-%d").date()
+    except (ValueError, TypeError) as e:
+        return None
+
+    return dt + datetime.timedelta(days=days)
+
+
+def embargo_expiry(package_dict):
+    """
+    the timestamp at which the package's embargo lifts, for expiring decisions
+    cached before then, or None if the package is not (or no longer) embargoed
+    """
+    lift_date = embargo_lift_date(package_dict)
+    if lift_date is None or datetime.date.today() >= lift_date:
+        return None
+    return cache.date_to_timestamp(lift_date)
+
+
+def embargo_state(package_dict):
+    """
+    one of "none" (the package is not time-bound), "embargoed" or "lifted"
+    """
+    lift_date = embargo_lift_date(package_dict)
+    if lift_date is None:
+        return "none"
+    if datetime.date.today() >= lift_date:
+        return "lifted"
+    return "embargoed"
+
+
 def initiatives_check_user_resource_access(user, resource_dict, package_dict):
     """
     note: calling methods will check if the user has write-access to the enclosing
     package (they are an admin or manager), in which case this method will not be
     called
     """
+    start = timeit.default_timer()
+
+    resource_permissions = get_resource_permissions(package_dict)
+    permission_handler = compile_resource_permissions(resource_permissions)
+    result = permission_handler(user, resource_dict, package_dict)
+
+    audit.record(
+        user,
+        resource_dict,
+        package_dict,
+        resource_permissions,
+        result,
+        timeit.default_timer() - start,
+    )
+    return result
+
+
+def initiatives_check_user_package_access(user, package_dict):
+    """
+    the decision for every resource of the package: editors of the package may
+    access them all, and the permission handlers decide from the package alone
+    """
+    if user_can_edit_package(user, package_dict):
+        return access_granted(None, "package_editor")
+
+    return initiatives_check_user_resource_access(
+        user, {"package_id": package_dict.get("id")}, package_dict
+    )
 
-    resource_permissions = get_key_maybe_extras(package_dict, "resource_permissions")
-    permission_handler = parse_resource_permissions(resource_permissions)
 
-    return permission_handler(user, resource_dict, package_dict)
+def initiatives_check_user_resources_access(user, package_dict):
+    """
+    each resource of the package checked on its own, as the resource_show auth
+    function does: the reference for initiatives_check_user_package_access
+    """
+    decisions = []
+    for resource in package_dict.get("resources", []):
+        context = {"model": model, "user": user}
+        if authz.is_authorized(
+            "package_update", context, {"id": resource.get("package_id")}
+        ).get("success"):
+            decisions.append(access_granted(None, "package_editor"))
+        else:
+            decisions.append(
+                initiatives_check_user_resource_access(user, resource, package_dict)
+            )
+    return decisions
+
+
+# the keys annotate_package_resources adds, never to be saved
+ANNOTATION_KEYS = ("initiatives_accessible", "initiatives_access_reason")
+
+# set on the context of calls whose package_show is not to be annotated
+SKIP_ANNOTATION = "initiatives_skip_annotation"
+
+
+def strip_annotations(data_dict):
+    """
+    remove what annotate_package_resources added from a package (or resource)
+    dict about to be saved, e.g. one shown, edited and sent back
+    """
+    for obj in [data_dict] + list(data_dict.get("resources") or []):
+        if isinstance(obj, dict):
+            for key in ANNOTATION_KEYS:
+                obj.pop(key, None)
+
+
+def annotate_package_resources(package_dict, decisions):
+    for resource, decision in zip(package_dict.get("resources", []), decisions):
+        resource["initiatives_accessible"] = decision.get("success", False)
+        resource["initiatives_access_reason"] = decision.get("reason")
+
+
+def redact_package_resources(package_dict, decisions):
+    for resource, decision in zip(package_dict.get("resources", []), decisions):
+        if not decision.get("success"):
+            resource["url"] = ""
+
+
+def initiatives_package_policy_dict(package, extras=None):
+    """
+    only the fields of a package object that the permission handlers look at,
+    so that the whole package does not have to be dictized. `extras`, if
+    given, are the package's extras as initiatives_packages_extras loaded
+    them.
+    """
+    return {
+        "id": package.id,
+        "owner_org": package.owner_org,
+        "extras": dict(package.extras) if extras is None else extras,
+    }
+
+
+def initiatives_packages_extras(package_ids):
+    """
+    the extras of several packages, with one query rather than one for each
+    package's `extras`
+    """
+    query = model.Session.query(
+        model.PackageExtra.package_id,
+        model.PackageExtra.key,
+        model.PackageExtra.value,
+    ).filter(model.PackageExtra.package_id.in_(list(package_ids)))
+    # extras have no state from CKAN 2.11
+    if hasattr(model.PackageExtra, "state"):
+        query = query.filter(model.PackageExtra.state == "active")
+    extras = dict((package_id, {}) for package_id in package_ids)
+    for package_id, key, value in query:
+        extras[package_id][key] = value
+    return extras
+
+
+def initiatives_membership_version(user_name):
+    """
+    a digest of everything about the user that can change an access decision:
+    sysadmin status, their organization memberships and the parents of those
+    organizations. Two database queries, no dictization.
+    """
+    user = model.User.get(user_name) if user_name else None
+    if user is None or user.state != "active":
+        return "anonymous"
+
+    memberships = (
+        model.Session.query(model.Member.group_id, model.Member.capacity)
+        .filter(model.Member.table_name == "user")
+        .filter(model.Member.table_id == user.id)
+        .filter(model.Member.state == "active")
+        .all()
+    )
+    group_ids = sorted(set(group_id for group_id, _capacity in memberships))
+    parents = []
+    if group_ids:
+        # a parent is stored as Member(group_id=<child>, table_id=<parent>),
+        # as Group.get_parent_groups reads it
+        parents = (
+            model.Session.query(model.Member.group_id, model.Member.table_id)
+            .filter(model.Member.table_name == "group")
+            .filter(model.Member.group_id.in_(group_ids))
+            .filter(model.Member.state == "active")
+            .all()
+        )
+
+    digest = hashlib.sha1()
+    digest.update(("%s|%s|" % (user.id, user.sysadmin)).encode("utf8"))
+    for row in sorted(memberships) + sorted(parents):
+        digest.update(("%s:%s|" % tuple(row)).encode("utf8"))
+    return digest.hexdigest()
+
+
+def initiatives_decision_version(user_name, package_id, resource_id):
+    """
+    a token which changes whenever the result of `initiatives_check_access`
+    for this user and resource could change: the package has been modified,
+    the user's memberships have changed or the package's embargo has lifted.
+
+    Returns None if the package or resource does not exist.
+    """
+    package = model.Package.get(package_id)
+    resource = model.Resource.get(resource_id)
+    if package is None or resource is None:
+        return None
+
+    package_dict = initiatives_package_policy_dict(package)
+
+    parts = [
+        user_name or "",
+        package.id,
+        package.metadata_modified.isoformat() if package.metadata_modified else "",
+        resource.id,
+        resource.package_id,
+        initiatives_membership_version(user_name),
+        get_resource_permissions(package_dict),
+        embargo_state(package_dict),
+    ]
+    return hashlib.sha1("|".join(parts).encode("utf8")).hexdigest()
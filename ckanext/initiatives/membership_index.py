@@ -0,0 +1,284 @@
+# coding: utf8
+
+from __future__ import unicode_literals
+import sys
+import threading
+import time
+
+import ckan.authz as authz
+import ckan.model as model
+from ckanext.initiatives import cache, hierarchy
+
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+# config options
+#
+#   ckanext.initiatives.membership_index.ttl   seconds the index of every
+#                                              user's memberships is kept
+#                                              before being loaded again
+#                                              (default 0: the index is not
+#                                              used)
+
+INDEX_PREFIX = "ckanext.initiatives.membership_index."
+
+
+class _BitSet(object):
+    """
+    the organizations in a bitset, by id (or by name, given the name -> bit
+    map); what `in` tests against UserOrganizations.org_ids and org_names
+    """
+
+    __slots__ = ("_bits", "_members", "_keys")
+
+    def __init__(self, bits, members, keys):
+        self._bits = bits
+        self._members = members
+        self._keys = keys
+
+    def __contains__(self, key):
+        bit = self._bits.get(key)
+        return bit is not None and (self._members >> bit) & 1 == 1
+
+    def __iter__(self):
+        # for callers which need them all
+        members, bit = self._members, 0
+        while members:
+            if members & 1:
+                yield self._keys[bit]
+            members >>= 1
+            bit += 1
+
+
+class _Bits(object):
+    # organization id -> bit and name -> bit, kept apart so that an id is
+    # never taken for a name or the other way around; ids and names by bit
+    # kept alongside
+    __slots__ = ("by_id", "by_name", "org_ids", "org_names")
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_name = {}
+        self.org_ids = []
+        self.org_names = []
+
+
+class IndexedUserOrganizations(object):
+    """
+    A user's memberships from the index, answering the same membership tests
+    as UserOrganizations with integer bit tests
+    """
+
+    __slots__ = ("org_ids", "org_names", "organization_show_calls", "resolved_at")
+
+    def __init__(self, bits, members, expanded, resolved_at):
+        self.org_ids = _BitSet(bits.by_id, members, bits.org_ids)
+        self.org_names = _BitSet(bits.by_name, expanded, bits.org_names)
+        self.organization_show_calls = 0
+        self.resolved_at = resolved_at
+
+
+class MembershipIndex(object):
+    """
+    Every user's organization memberships, with organization ids and names
+    interned to small integers and each user's memberships held as two
+    bitsets (Python ints): the organizations they can read, and those plus
+    their parents, as UserOrganizations has them.
+    """
+
+    def __init__(self):
+        self.bits = _Bits()
+        self.users = {}
+        self.loaded_at = time.time()
+
+    def intern(self, org_id, org_name):
+        bit = self.bits.by_id.get(org_id)
+        if bit is None:
+            bit = len(self.bits.org_ids)
+            self.bits.org_ids.append(org_id)
+            self.bits.org_names.append(org_name)
+            self.bits.by_id[org_id] = bit
+            if org_name:
+                self.bits.by_name[org_name] = bit
+        return bit
+
+    def add_user(self, user_name, org_bits, parent_bits):
+        members = 0
+        for bit in org_bits:
+            members |= 1 << bit
+        expanded = members
+        for bit in parent_bits:
+            expanded |= 1 << bit
+        self.users[user_name] = (members, expanded)
+
+    def user_organizations(self, user_name):
+        """
+        the user's memberships, or None if the user is not in the index
+        """
+        entry = self.users.get(user_name)
+        if entry is None:
+            return None
+        return IndexedUserOrganizations(self.bits, entry[0], entry[1], self.loaded_at)
+
+    def member_of(self, user_name, org_id_or_name):
+        # as authz does, an id is tried first, then a name
+        entry = self.users.get(user_name)
+        bit = self.bits.by_id.get(org_id_or_name)
+        if bit is None:
+            bit = self.bits.by_name.get(org_id_or_name)
+        return entry is not None and bit is not None and (entry[0] >> bit) & 1 == 1
+
+    def footprint(self):
+        """
+        approximate bytes held by the index: the interning tables, and the
+        users' entries and bitsets (user names are shared with the rest of
+        the process and not counted)
+        """
+        interning = sum(
+            sys.getsizeof(bits) for bits in (self.bits.by_id, self.bits.by_name)
+        ) + sum(
+            sys.getsizeof(org_list) + sum(sys.getsizeof(key) for key in org_list)
+            for org_list in (self.bits.org_ids, self.bits.org_names)
+        )
+        users = sys.getsizeof(self.users) + sum(
+            sys.getsizeof(entry) + sys.getsizeof(entry[0]) + sys.getsizeof(entry[1])
+            for entry in self.users.values()
+        )
+        return {"interning": interning, "users": users, "total": interning + users}
+
+    @classmethod
+    def load(cls):
+        """
+        build the index of every active user with two queries, plus the
+        organization hierarchy, expanding memberships as
+        organization_list_for_user and UserOrganizations do: members in a role
+        which cascades (admins, by default) can read the organization's
+        sub-organizations, sysadmins can read every organization, and the
+        parents of readable organizations are added to the expanded set.
+
+        Parents are added whatever their type or state, as organization_show
+        lists them: a consortium may be a plain group, or deleted. Those which
+        are not active organizations are looked up with one more query.
+        """
+        index = cls()
+        organizations = hierarchy.organizations.index()
+        for org_id, org_name in organizations.names.items():
+            index.intern(org_id, org_name)
+        other_parent_ids = set(
+            parent_id
+            for child_id, parent_ids in organizations.parents.items()
+            if child_id in organizations.names
+            for parent_id in parent_ids
+            if parent_id not in organizations.names
+        )
+        if other_parent_ids:
+            groups = model.Session.query(model.Group.id, model.Group.name).filter(
+                model.Group.id.in_(list(other_parent_ids))
+            )
+            for group_id, group_name in groups:
+                index.intern(group_id, group_name)
+
+        children = {}
+        for child_id, parent_ids in organizations.parents.items():
+            for parent_id in parent_ids:
+                children.setdefault(parent_id, []).append(child_id)
+
+        def with_descendants(org_ids):
+            found = set()
+            pending = list(org_ids)
+            while pending:
+                org_id = pending.pop()
+                if org_id not in found and org_id in organizations.names:
+                    found.add(org_id)
+                    pending.extend(children.get(org_id, []))
+            return found
+
+        cascading_roles = authz.check_config_permission(
+            "roles_that_cascade_to_sub_groups"
+        )
+        memberships = {}
+        rows = (
+            model.Session.query(
+                model.User.name, model.Member.group_id, model.Member.capacity
+            )
+            .join(model.Member, model.Member.table_id == model.User.id)
+            .filter(model.Member.table_name == "user")
+            .filter(model.Member.state == "active")
+            .filter(model.User.state == "active")
+        )
+        for user_name, group_id, capacity in rows:
+            org_ids = set([group_id])
+            if capacity in cascading_roles:
+                org_ids = with_descendants(org_ids)
+            memberships.setdefault(user_name, set()).update(org_ids)
+
+        users = model.Session.query(model.User.name, model.User.sysadmin).filter(
+            model.User.state == "active"
+        )
+        all_orgs = set(organizations.names)
+        for user_name, sysadmin in users:
+            if sysadmin:
+                org_ids = all_orgs
+            else:
+                org_ids = memberships.get(user_name, set()) & all_orgs
+            parent_ids = set()
+            for org_id in org_ids:
+                parent_ids.update(organizations.parents.get(org_id, []))
+            index.add_user(
+                user_name,
+                [index.bits.by_id[org_id] for org_id in org_ids],
+                [
+                    index.bits.by_id[org_id]
+                    for org_id in parent_ids
+                    if org_id in index.bits.by_id
+                ],
+            )
+
+        log.debug(
+            "indexed memberships of %d users in %d organizations",
+            len(index.users),
+            len(index.bits.org_ids),
+        )
+        return index
+
+
+class _IndexHolder(object):
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._index = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._loads = cache.SingleFlight()
+
+    def index(self):
+        """
+        the current index, loading it if needed, or None when it is disabled
+        """
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            index = self._index
+            if index is not None and time.time() - index.loaded_at < self.ttl:
+                return index
+            generation = self._generation
+        index = self._loads.do("index", MembershipIndex.load)
+        with self._lock:
+            # not kept if invalidated while loading: it may predate the change
+            if self._generation == generation:
+                self._index = index
+        return index
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._generation += 1
+
+
+memberships = _IndexHolder(0)
+
+
+def configure(config):
+    memberships.ttl = int(config.get(INDEX_PREFIX + "ttl", 0))
+    memberships.invalidate()
@@ -1,27 +1,74 @@
 import logging
+import ckan.model as model
 import ckan.plugins as plugins
-from ckanext.initiatives import action, auth, helpers
+import ckan.plugins.toolkit as toolkit
+from ckanext.initiatives import (
+    action,
+    audit,
+    auth,
+    cache,
+    cli,
+    helpers,
+    hierarchy,
+    invalidation,
+    logic,
+    membership_index,
+    shadow,
+    views,
+    warmup,
+)
 
 
 log = logging.getLogger(__name__)
 
 
 class InitiativesPlugin(plugins.SingletonPlugin):
+    redact_restricted_urls = False
+
     plugins.implements(plugins.IActions)
     plugins.implements(plugins.IConfigurer)
+    plugins.implements(plugins.IConfigurable)
     plugins.implements(plugins.IAuthFunctions)
     plugins.implements(plugins.ITemplateHelpers)
+    plugins.implements(plugins.IBlueprint)
+    plugins.implements(plugins.IPackageController, inherit=True)
+    plugins.implements(plugins.IOrganizationController, inherit=True)
+    plugins.implements(plugins.IMiddleware, inherit=True)
+    plugins.implements(plugins.IClick)
 
     # IConfigurer
     def update_config(self, config):
         plugins.toolkit.add_template_directory(config, "templates")
         plugins.toolkit.add_public_directory(config, "static")
 
+    # IConfigurable
+    def configure(self, config):
+        audit.configure(config)
+        cache.configure(config)
+        shadow.configure(config)
+        hierarchy.configure(config)
+        membership_index.configure(config)
+        invalidation.configure(config)
+        if invalidation.other_workers_stale():
+            log.warning(
+                "initiatives caches are on, but invalidations only reach this "
+                "process: with several workers, set "
+                "ckanext.initiatives.invalidation.bus = redis"
+            )
+        self.redact_restricted_urls = toolkit.asbool(
+            config.get("ckanext.initiatives.redact_restricted_urls", False)
+        )
+
     # IAuthFunctions
     def get_auth_functions(self):
         return {
             "resource_show": auth.initiatives_resource_show,
             "resource_view_show": auth.initiatives_resource_show,
+            "initiatives_shadow_report": auth.initiatives_sysadmin_only,
+            "initiatives_explain_access": auth.initiatives_sysadmin_only,
+            "initiatives_invalidation_status": auth.initiatives_sysadmin_only,
+            # the full status; anyone may ask whether it is ready
+            "initiatives_warmup_status": auth.initiatives_sysadmin_only,
         }
 
     # IActions
@@ -29,8 +76,118 @@ class InitiativesPlugin(plugins.SingletonPlugin):
         return {
             "resource_view_list": action.initiatives_resource_view_list,
             "initiatives_check_access": action.initiatives_check_access,
+            "initiatives_accessible_resources": action.initiatives_accessible_resources,
+            "initiatives_shadow_report": action.initiatives_shadow_report,
+            "initiatives_explain_access": action.initiatives_explain_access,
+            "initiatives_warmup_status": action.initiatives_warmup_status,
+            "initiatives_invalidation_status": action.initiatives_invalidation_status,
+            "package_search": action.initiatives_package_search,
+            "resource_show": action.initiatives_resource_show,
+            "package_create": action.initiatives_package_create,
+            "package_update": action.initiatives_package_update,
+            "package_patch": action.initiatives_package_patch,
+            "member_create": action.initiatives_member_create,
+            "member_delete": action.initiatives_member_delete,
         }
 
     # ITemplateHelpers
     def get_helpers(self):
         return {"initiatives_get_user_id": helpers.initiatives_get_user_id}
+
+    # IBlueprint
+    def get_blueprint(self):
+        return [views.initiatives]
+
+    # IClick
+    def get_commands(self):
+        return cli.get_commands()
+
+    # IMiddleware
+    def make_middleware(self, app, config):
+        # the app is ready: warm the caches in the background, if configured
+        warmup.start(app, config)
+        return app
+
+    # IPackageController
+    def after_dataset_update(self, context, pkg_dict):
+        invalidation.publish_after_commit("package", pkg_dict.get("id"))
+
+    def after_dataset_delete(self, context, pkg_dict):
+        invalidation.publish_after_commit("package", pkg_dict.get("id"))
+
+    def after_dataset_search(self, search_results, search_params):
+        # annotated for the caller of package_search; searches made on no
+        # one's behalf are left as they are
+        context = logic.get_search_context()
+        if context is None or context.get("ignore_auth"):
+            return search_results
+
+        # one membership lookup for the page, one decision per package
+        user_name = logic.initiatives_get_username_from_context(context)
+        with logic.membership_scope():
+            for pkg_dict in search_results.get("results", []):
+                self._apply_decisions(user_name, pkg_dict)
+        return search_results
+
+    def after_dataset_show(self, context, pkg_dict):
+        # only packages shown to an API caller or on a page are annotated:
+        # not those shown for indexing, to be edited and saved back, or
+        # within other actions
+        if (
+            context.get("ignore_auth")
+            or context.get("for_update")
+            or context.get("for_edit")
+            or context.get(logic.SKIP_ANNOTATION)
+            or not (context.get("api_version") or context.get("for_view"))
+        ):
+            return pkg_dict
+
+        user_name = logic.initiatives_get_username_from_context(context)
+        self._apply_decisions(user_name, pkg_dict)
+        return pkg_dict
+
+    def _apply_decisions(self, user_name, pkg_dict):
+        resources = pkg_dict.get("resources")
+        if not resources:
+            return
+
+        # one decision for all of the package's resources, checked against
+        # each resource on its own in shadow mode
+        decisions = shadow.compare(
+            "package_batch",
+            lambda: logic.initiatives_check_user_resources_access(user_name, pkg_dict),
+            lambda: [logic.initiatives_check_user_package_access(user_name, pkg_dict)]
+            * len(resources),
+            {"user": user_name, "package_id": pkg_dict.get("id")},
+        )
+        logic.annotate_package_resources(pkg_dict, decisions)
+        if self.redact_restricted_urls:
+            logic.redact_package_resources(pkg_dict, decisions)
+
+    # IOrganizationController (IPackageController has the same hooks, called
+    # with packages)
+    def create(self, entity):
+        self._organizations_changed(entity)
+
+    def edit(self, entity):
+        self._organizations_changed(entity)
+
+    def delete(self, entity):
+        self._organizations_changed(entity)
+
+    def _organizations_changed(self, entity):
+        if isinstance(entity, model.Group) and entity.is_organization:
+            invalidation.publish_after_commit("organizations")
+
+    # CKAN < 2.10
+    def after_update(self, context, pkg_dict):
+        return self.after_dataset_update(context, pkg_dict)
+
+    def after_delete(self, context, pkg_dict):
+        return self.after_dataset_delete(context, pkg_dict)
+
+    def after_search(self, search_results, search_params):
+        return self.after_dataset_search(search_results, search_params)
+
+    def after_show(self, context, pkg_dict):
+        return self.after_dataset_show(context, pkg_dict)
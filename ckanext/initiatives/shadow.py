@@ -0,0 +1,124 @@
+# coding: utf8
+
+from __future__ import unicode_literals
+import collections
+import json
+import random
+import threading
+import timeit
+
+from ckanext.initiatives import audit, logic
+
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+# config options
+#
+#   ckanext.initiatives.shadow.sample_rate    shadow mode is on when above 0
+#                                             (default 0, off): every decision
+#                                             is made by the reference
+#                                             evaluator, and this fraction of
+#                                             them by the optimized path as
+#                                             well, to be compared
+#   ckanext.initiatives.shadow.mismatches     mismatches kept for the report
+#                                             (default 100)
+
+SHADOW_PREFIX = "ckanext.initiatives.shadow."
+
+
+class ShadowStats(object):
+    """
+    Per optimized path: how many decisions were compared, how many disagreed
+    with the reference, and the time each evaluator took
+    """
+
+    def __init__(self, max_mismatches=100):
+        self.paths = {}
+        self.mismatches = collections.deque(maxlen=max_mismatches)
+        self._lock = threading.Lock()
+
+    def add(self, path, reference_time, optimized_time, mismatch):
+        with self._lock:
+            stats = self.paths.setdefault(
+                path,
+                {"compared": 0, "mismatched": 0, "reference_s": 0.0, "optimized_s": 0.0},
+            )
+            stats["compared"] += 1
+            stats["reference_s"] += reference_time
+            stats["optimized_s"] += optimized_time
+            if mismatch is not None:
+                stats["mismatched"] += 1
+                self.mismatches.append(mismatch)
+
+    def report(self):
+        with self._lock:
+            paths = {}
+            for path, stats in self.paths.items():
+                compared = stats["compared"]
+                paths[path] = {
+                    "compared": compared,
+                    "mismatched": stats["mismatched"],
+                    "reference_mean_ms": 1000.0 * stats["reference_s"] / compared,
+                    "optimized_mean_ms": 1000.0 * stats["optimized_s"] / compared,
+                }
+            return {"paths": paths, "mismatches": list(self.mismatches)}
+
+
+sample_rate = 0.0
+stats = ShadowStats()
+
+
+def configure(config):
+    global sample_rate, stats
+
+    sample_rate = float(config.get(SHADOW_PREFIX + "sample_rate", 0.0))
+    stats = ShadowStats(int(config.get(SHADOW_PREFIX + "mismatches", 100)))
+
+
+def _outcome(result):
+    # a single decision, or one for each resource of a package
+    if isinstance(result, list):
+        return [bool(r.get("success")) for r in result]
+    return bool(result.get("success"))
+
+
+def compare(path, reference, optimized, details):
+    """
+    the decision of `optimized()`, unless shadow mode is on: then the
+    decision of `reference()`, made with memberships resolved afresh, and for
+    a sampled fraction of calls `optimized()` is made as well and compared
+    with it.
+
+    Only the returned decision is audited: the optimized one is not while
+    shadowing.
+    """
+    if not sample_rate:
+        return optimized()
+
+    start = timeit.default_timer()
+    with logic.reference_evaluation():
+        reference_result = reference()
+    reference_time = timeit.default_timer() - start
+
+    if random.random() >= sample_rate:
+        return reference_result
+
+    start = timeit.default_timer()
+    with audit.suppressed():
+        optimized_result = optimized()
+    optimized_time = timeit.default_timer() - start
+
+    mismatch = None
+    if _outcome(reference_result) != _outcome(optimized_result):
+        mismatch = dict(
+            details,
+            path=path,
+            reference=reference_result,
+            optimized=optimized_result,
+        )
+        log.warning("shadow evaluation mismatch: %s", json.dumps(mismatch, default=str))
+    stats.add(path, reference_time, optimized_time, mismatch)
+
+    return reference_result
@@ -0,0 +1,17 @@
+import datetime
+import time
+
+from freezegun import freeze_time
+
+
+def freeze_local(local_time):
+    """
+    freeze_time at `local_time` ("YYYY-MM-DD HH:MM:SS") on this machine's
+    clock, so that time.time() and time.mktime() agree with
+    datetime.date.today() whatever the machine's time zone
+    """
+    moment = datetime.datetime.strptime(local_time, "%Y-%m-%d %H:%M:%S")
+    utc = datetime.datetime.fromtimestamp(
+        time.mktime(moment.timetuple()), datetime.timezone.utc
+    ).replace(tzinfo=None)
+    return freeze_time(utc, tz_offset=moment - utc)
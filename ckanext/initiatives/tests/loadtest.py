@@ -0,0 +1,214 @@
+"""
+An in-process load test harness for restricted dataset pages.
+
+Requests go through the CKAN test app's WSGI client, so there is no network
+involved: what is measured is CKAN, this extension and the database. Use it
+from a test which has the `app` fixture, e.g.
+
+    scenario = build_scenario()
+    report = run_load_test(app, scenario, threads=32, requests_per_thread=200)
+    print(format_report(report))
+"""
+import datetime
+import random
+import threading
+import timeit
+
+from six.moves.urllib.parse import urlencode
+
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+
+# relative frequency of each kind of user and request in the traffic mix
+USER_MIX = {"anonymous": 5, "member": 3, "consortium": 2}
+OPERATION_MIX = {
+    "dataset_read": 2,
+    "resource_show": 3,
+    "resource_view_list": 2,
+    "initiatives_check_access": 3,
+}
+
+
+def _api_token(user):
+    return helpers.call_action(
+        "api_token_create",
+        {"user": user["name"], "ignore_auth": True},
+        user=user["name"],
+        name="loadtest",
+    )["token"]
+
+
+def build_scenario(datasets_per_policy=5, resources_per_dataset=3, users_per_kind=5):
+    """
+    create an owner organization and a consortium organization, member and
+    consortium users, and embargoed, member-only and public datasets
+    """
+    owner_org = factories.Organization()
+    consortium_org = factories.Organization()
+
+    users = {"anonymous": [None]}
+    users["member"] = [factories.User() for i in range(users_per_kind)]
+    users["consortium"] = [factories.User() for i in range(users_per_kind)]
+    for org, kind in ((owner_org, "member"), (consortium_org, "consortium")):
+        for user in users[kind]:
+            helpers.call_action(
+                "organization_member_create",
+                {"ignore_auth": True},
+                id=org["id"],
+                username=user["name"],
+                role="member",
+            )
+    tokens = {
+        kind: [_api_token(user) if user else None for user in kind_users]
+        for kind, kind_users in users.items()
+    }
+
+    policies = {
+        "embargoed": [
+            {
+                "key": "resource_permissions",
+                "value": "organization_member_after_embargo:date_of_transfer_to_archive:90:%s"
+                % consortium_org["name"],
+            },
+            {
+                "key": "date_of_transfer_to_archive",
+                "value": datetime.date.today().strftime("%Y-%m-%d"),
+            },
+        ],
+        "member_only": [],
+        "public": [{"key": "resource_permissions", "value": "public"}],
+    }
+    datasets = []
+    for policy, extras in policies.items():
+        for i in range(datasets_per_policy):
+            dataset = factories.Dataset(owner_org=owner_org["id"], extras=extras)
+            dataset["resources"] = [
+                factories.Resource(package_id=dataset["id"])
+                for j in range(resources_per_dataset)
+            ]
+            datasets.append(dataset)
+
+    return {"tokens": tokens, "datasets": datasets}
+
+
+def _choose(rng, mix):
+    return rng.choice([key for key, weight in mix.items() for i in range(weight)])
+
+
+def _request(client, rng, scenario, operation, token):
+    dataset = rng.choice(scenario["datasets"])
+    resource = rng.choice(dataset["resources"])
+    headers = {"Authorization": token} if token else {}
+
+    # plain paths rather than url_for, which wants a request context
+    if operation == "dataset_read":
+        url = "/dataset/%s" % dataset["name"]
+    elif operation == "initiatives_check_access":
+        url = "/api/3/action/%s?%s" % (
+            operation,
+            urlencode({"package_id": dataset["id"], "resource_id": resource["id"]}),
+        )
+    else:
+        url = "/api/3/action/%s?%s" % (operation, urlencode({"id": resource["id"]}))
+    return client.get(url, headers=headers).status_code
+
+
+def _percentile(sorted_values, percent):
+    # nearest rank
+    if not sorted_values:
+        return None
+    rank = max(int(round(percent / 100.0 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+def _summarise(samples, elapsed):
+    latencies = sorted(latency for latency, status in samples)
+    return {
+        "requests": len(samples),
+        "errors": len([s for latency, s in samples if s is None or s >= 500]),
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "requests_per_second": len(samples) / elapsed if elapsed else None,
+    }
+
+
+def run_load_test(app, scenario, threads=8, requests_per_thread=50, seed=0):
+    """
+    drive `threads` concurrent clients through the traffic mix, each sending
+    `requests_per_thread` requests, and report latency percentiles and
+    throughput overall and per operation. Responses of 500 and above, and
+    requests that raise, are counted as errors; 403s for restricted resources
+    are expected.
+    """
+    samples = {operation: [] for operation in OPERATION_MIX}
+    lock = threading.Lock()
+    # all threads start sending at once
+    barrier = threading.Barrier(threads)
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        client = app.flask_app.test_client()
+        own = []
+        barrier.wait()
+        for i in range(requests_per_thread):
+            operation = _choose(rng, OPERATION_MIX)
+            token = rng.choice(scenario["tokens"][_choose(rng, USER_MIX)])
+            start = timeit.default_timer()
+            try:
+                status = _request(client, rng, scenario, operation, token)
+            except Exception:
+                status = None
+            own.append((operation, (timeit.default_timer() - start) * 1000.0, status))
+        with lock:
+            for operation, latency, status in own:
+                samples[operation].append((latency, status))
+
+    workers = [
+        threading.Thread(target=worker, args=(index,)) for index in range(threads)
+    ]
+    start = timeit.default_timer()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = timeit.default_timer() - start
+
+    report = {
+        "threads": threads,
+        "elapsed_s": elapsed,
+        "total": _summarise(
+            [sample for operation in samples.values() for sample in operation],
+            elapsed,
+        ),
+        "operations": {},
+    }
+    for operation, operation_samples in samples.items():
+        report["operations"][operation] = _summarise(operation_samples, elapsed)
+    return report
+
+
+def format_report(report):
+    lines = [
+        "%d threads, %.2fs" % (report["threads"], report["elapsed_s"]),
+        "%-26s %8s %6s %9s %9s %9s %9s"
+        % ("operation", "requests", "errors", "p50 ms", "p95 ms", "p99 ms", "req/s"),
+    ]
+    rows = sorted(report["operations"].items()) + [("total", report["total"])]
+    for name, summary in rows:
+        if not summary["requests"]:
+            continue
+        lines.append(
+            "%-26s %8d %6d %9.1f %9.1f %9.1f %9.1f"
+            % (
+                name,
+                summary["requests"],
+                summary["errors"],
+                summary["p50_ms"],
+                summary["p95_ms"],
+                summary["p99_ms"],
+                summary["requests_per_second"],
+            )
+        )
+    return "\n".join(lines)
@@ -163,3 +163,65 @@ class TestInitiativesAction(object):
         result = helpers.call_action('initiatives_check_access', context, package_id=package_id, resource_id=resource_id)
 
         assert result.get("success") is False
+
+    @pytest.mark.usefixtures("clean_db")
+    def test_initiatives_accessible_resources(self):
+        user = factories.User()
+        member_org = factories.Organization(users=[{
+            'name': user['id'],
+            'capacity': 'member'
+        }])
+        other_org = factories.Organization()
+        member_package = factories.Dataset(owner_org=member_org['id'])
+        other_package = factories.Dataset(owner_org=other_org['id'])
+        public_package = factories.Dataset(
+            owner_org=other_org['id'],
+            extras=[{'key': 'resource_permissions', 'value': 'public'}],
+        )
+        accessible = set()
+        for package in (member_package, public_package):
+            for i in range(3):
+                accessible.add(factories.Resource(package_id=package['id'])['id'])
+        for i in range(3):
+            factories.Resource(package_id=other_package['id'])
+
+        context = {'ignore_auth': False, 'user': user['name']}
+
+        found = []
+        cursor = None
+        pages = 0
+        while True:
+            result = helpers.call_action(
+                'initiatives_accessible_resources', context, cursor=cursor, limit=2
+            )
+            found.extend(resource['id'] for resource in result['resources'])
+            pages += 1
+            cursor = result['cursor']
+            if cursor is None:
+                break
+
+        assert len(found) == len(accessible)
+        assert set(found) == accessible
+        assert pages >= 5
+
+    @pytest.mark.usefixtures("clean_db")
+    def test_initiatives_accessible_resources_anonymous(self):
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org['id'])
+        factories.Resource(package_id=package['id'])
+
+        context = {'ignore_auth': False, 'user': ''}
+
+        result = helpers.call_action('initiatives_accessible_resources', context)
+
+        assert result == {'resources': [], 'cursor': None}
+
+    @pytest.mark.usefixtures("clean_db")
+    def test_initiatives_accessible_resources_invalid_cursor(self):
+        context = {'ignore_auth': True}
+
+        for cursor in ('not a cursor', 123, ['a', 'b']):
+            with pytest.raises(ckan.logic.ValidationError, match='Invalid cursor'):
+                helpers.call_action(
+                    'initiatives_accessible_resources', context, cursor=cursor
+                )
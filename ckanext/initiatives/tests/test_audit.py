@@ -0,0 +1,149 @@
+"""
+Tests for audit.py.
+"""
+import json
+
+import pytest
+
+import ckan.tests.factories as factories
+
+import ckanext.initiatives.audit as initiatives_audit
+import ckanext.initiatives.logic as initiatives_logic
+
+
+def _read_entries(path):
+    with open(str(path)) as f:
+        return [json.loads(line) for line in f]
+
+
+class TestAuditLog(object):
+    def test_record(self, tmp_path):
+        path = tmp_path / "audit.jsonl"
+        audit_log = initiatives_audit.AuditLog(
+            str(path), {"granted": 1.0, "denied": 1.0}
+        )
+
+        audit_log.record(
+            "alice",
+            {"id": "resource-1", "package_id": "package-1"},
+            {},
+            "public",
+            initiatives_logic.access_granted(None, "public"),
+            0.002,
+        )
+        audit_log.stop()
+
+        entries = _read_entries(path)
+
+        assert len(entries) == 1
+        assert entries[0]["user"] == "alice"
+        assert entries[0]["resource_id"] == "resource-1"
+        assert entries[0]["package_id"] == "package-1"
+        assert entries[0]["policy"] == "public"
+        assert entries[0]["outcome"] == "granted"
+        assert entries[0]["reason"] == "public"
+        assert entries[0]["latency_ms"] == 2.0
+
+    def test_sample_rates(self, tmp_path):
+        path = tmp_path / "audit.jsonl"
+        audit_log = initiatives_audit.AuditLog(
+            str(path), {"granted": 0.0, "denied": 1.0}
+        )
+
+        for i in range(10):
+            audit_log.record(
+                "alice",
+                {"id": "resource-1"},
+                {"id": "package-1"},
+                "",
+                initiatives_logic.access_granted(None, "organization_member"),
+                0.001,
+            )
+        audit_log.record(
+            None,
+            {"id": "resource-1"},
+            {"id": "package-1"},
+            "",
+            initiatives_logic.access_denied(None, "not_logged_in"),
+            0.001,
+        )
+        audit_log.stop()
+
+        entries = _read_entries(path)
+
+        assert len(entries) == 1
+        assert entries[0]["outcome"] == "denied"
+        assert entries[0]["reason"] == "not_logged_in"
+        assert entries[0]["user"] is None
+
+    def test_forked(self, tmp_path):
+        path = tmp_path / "audit.jsonl"
+        audit_log = initiatives_audit.AuditLog(
+            str(path), {"granted": 1.0, "denied": 1.0}
+        )
+        inherited = audit_log.listener
+        # as if forked: the writer thread was left behind in the parent
+        audit_log._pid = -1
+
+        audit_log.record(
+            "alice",
+            {"id": "resource-1"},
+            {"id": "package-1"},
+            "public",
+            initiatives_logic.access_granted(None, "public"),
+            0.001,
+        )
+        audit_log.stop()
+        inherited.stop()
+
+        assert audit_log.listener is not inherited
+        assert len(_read_entries(path)) == 1
+
+    def test_queue_full(self, tmp_path):
+        path = tmp_path / "audit.jsonl"
+        audit_log = initiatives_audit.AuditLog(
+            str(path), {"granted": 1.0, "denied": 1.0}, queue_size=1
+        )
+        # stop the writer so that the queue fills up
+        audit_log.listener.stop()
+
+        for i in range(3):
+            audit_log.record(
+                "alice",
+                {"id": "resource-1"},
+                {"id": "package-1"},
+                "public",
+                initiatives_logic.access_granted(None, "public"),
+                0.001,
+            )
+
+        assert audit_log.dropped == 2
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives")
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+def test_check_user_resource_access_is_audited(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    initiatives_audit.configure(
+        {"ckanext.initiatives.audit.path": str(path)}
+    )
+    try:
+        user = factories.User()
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"])
+
+        initiatives_logic.initiatives_check_user_resource_access(
+            user["name"], resource, package
+        )
+    finally:
+        initiatives_audit.stop()
+
+    entries = _read_entries(path)
+
+    assert len(entries) == 1
+    assert entries[0]["user"] == user["name"]
+    assert entries[0]["resource_id"] == resource["id"]
+    assert entries[0]["package_id"] == package["id"]
+    assert entries[0]["outcome"] == "denied"
+    assert entries[0]["reason"] == "not_organization_member"
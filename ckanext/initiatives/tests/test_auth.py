@@ -8,6 +8,9 @@ import ckan.model as model
 import ckan.logic as logic
 from ckan.common import g
 
+import ckanext.initiatives.cache as initiatives_cache
+from ckanext.initiatives.tests import freeze_local
+
 @pytest.mark.ckan_config("ckan.plugins", "initiatives")
 @pytest.mark.usefixtures("with_request_context", "with_plugins", "clean_db")
 class TestInitiativesAuth(object):
@@ -28,3 +31,125 @@ class TestInitiativesAuth(object):
         data_dict = {"id": resource["id"]}
 
         assert test_helpers.call_auth("resource_show", context=context, data_dict=data_dict)
+
+    @pytest.mark.ckan_config("ckanext.initiatives.anonymous_cache.ttl", "3600")
+    def test_initiatives_resource_show_anonymous_cached(self):
+        initiatives_cache.anonymous_decisions.clear()
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"])
+        context = {"user": "", "model": model}
+
+        with pytest.raises(logic.NotAuthorized):
+            test_helpers.call_auth(
+                "resource_show", context=dict(context), data_dict={"id": resource["id"]}
+            )
+
+        assert initiatives_cache.anonymous_decisions.get(package["id"]) is not None
+
+        # the package's policy changes: the cached decision is dropped
+        test_helpers.call_action(
+            "package_patch",
+            {"ignore_auth": True},
+            id=package["id"],
+            extras=[{"key": "resource_permissions", "value": "public"}],
+        )
+
+        assert initiatives_cache.anonymous_decisions.get(package["id"]) is None
+        assert test_helpers.call_auth(
+            "resource_show", context=dict(context), data_dict={"id": resource["id"]}
+        )
+
+
+EMBARGO_POLICY = "organization_member_after_embargo:date_of_transfer:365:consortium"
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives")
+@pytest.mark.ckan_config("ckanext.initiatives.decision_cache.ttl", "604800")
+@pytest.mark.usefixtures("with_request_context", "with_plugins", "clean_db")
+class TestInitiativesAuthDecisionCache(object):
+    def _setup(self, policy, date_of_transfer=None):
+        initiatives_cache.user_decisions.clear()
+        user = factories.User()
+        owner_org = factories.Organization(
+            users=[{"name": user["id"], "capacity": "member"}]
+        )
+        extras = [{"key": "resource_permissions", "value": policy}]
+        if date_of_transfer:
+            extras.append({"key": "date_of_transfer", "value": date_of_transfer})
+        package = factories.Dataset(owner_org=owner_org["id"], extras=extras)
+        resource = factories.Resource(package_id=package["id"])
+        return user, owner_org, package, resource
+
+    def _call_auth(self, user, resource):
+        return test_helpers.call_auth(
+            "resource_show",
+            context={"user": user["name"], "model": model},
+            data_dict={"id": resource["id"]},
+        )
+
+    def test_expires_when_embargo_lifts(self):
+        # 365 days after 2024-10-03 (a leap year) is 2025-10-03
+        user, owner_org, package, resource = self._setup(EMBARGO_POLICY, "2024-10-03")
+        key = (user["name"], package["id"])
+
+        with freeze_local("2025-09-26 12:00:00"):
+            with pytest.raises(logic.NotAuthorized):
+                self._call_auth(user, resource)
+            assert initiatives_cache.user_decisions.get(key) is not None
+
+        with freeze_local("2025-10-02 23:59:59"):
+            # still cached, and still right
+            assert initiatives_cache.user_decisions.get(key) is not None
+            with pytest.raises(logic.NotAuthorized):
+                self._call_auth(user, resource)
+
+        with freeze_local("2025-10-03 00:00:00"):
+            # the denial is never served past the lift
+            assert initiatives_cache.user_decisions.get(key) is None
+            assert self._call_auth(user, resource)
+            # and the grant is kept, no longer time-bound
+            assert initiatives_cache.user_decisions.get(key)["success"] is True
+
+        with freeze_local("2025-10-09 23:59:59"):
+            assert initiatives_cache.user_decisions.get(key)["success"] is True
+
+    def test_not_time_bound_kept(self):
+        user, owner_org, package, resource = self._setup("organization_member")
+        key = (user["name"], package["id"])
+
+        with freeze_local("2025-10-03 12:00:00"):
+            assert self._call_auth(user, resource)
+        with freeze_local("2025-10-10 11:59:59"):
+            assert initiatives_cache.user_decisions.get(key)["success"] is True
+        with freeze_local("2025-10-10 12:00:00"):
+            assert initiatives_cache.user_decisions.get(key) is None
+
+    def test_invalidated_by_membership_change(self):
+        user, owner_org, package, resource = self._setup("organization_member")
+        key = (user["name"], package["id"])
+
+        assert self._call_auth(user, resource)
+        assert initiatives_cache.user_decisions.get(key) is not None
+
+        test_helpers.call_action(
+            "organization_member_delete", id=owner_org["id"], username=user["name"]
+        )
+
+        assert initiatives_cache.user_decisions.get(key) is None
+        with pytest.raises(logic.NotAuthorized):
+            self._call_auth(user, resource)
+
+    def test_invalidated_by_package_change(self):
+        user, owner_org, package, resource = self._setup("organization_member")
+        key = (user["name"], package["id"])
+
+        assert self._call_auth(user, resource)
+
+        test_helpers.call_action(
+            "package_patch",
+            id=package["id"],
+            extras=[{"key": "resource_permissions", "value": "public"}],
+        )
+
+        assert initiatives_cache.user_decisions.get(key) is None
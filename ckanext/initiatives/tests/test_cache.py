@@ -0,0 +1,183 @@
+"""
+Tests for cache.py.
+"""
+import datetime
+import threading
+import time
+
+import pytest
+from freezegun import freeze_time
+
+import ckanext.initiatives.cache as initiatives_cache
+from ckanext.initiatives.tests import freeze_local
+
+
+@pytest.fixture
+def central_european_time(monkeypatch):
+    # DST starts on 2026-03-29
+    monkeypatch.setenv("TZ", "CET-1CEST,M3.5.0,M10.5.0/3")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+class TestExpiringCache(object):
+    def test_get_set(self):
+        cache = initiatives_cache.ExpiringCache(60, 10)
+
+        assert cache.get("package") is None
+
+        cache.set("package", {"success": False})
+
+        assert cache.get("package") == {"success": False}
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_ttl(self):
+        cache = initiatives_cache.ExpiringCache(60, 10)
+
+        with freeze_time("2025-10-03 12:00:00"):
+            cache.set("package", {"success": False})
+        with freeze_time("2025-10-03 12:00:59"):
+            assert cache.get("package") == {"success": False}
+        with freeze_time("2025-10-03 12:01:00"):
+            assert cache.get("package") is None
+
+    def test_expires_at(self):
+        cache = initiatives_cache.ExpiringCache(86400 * 30, 10)
+
+        with freeze_local("2025-10-03 12:00:00"):
+            cache.set(
+                "package",
+                {"success": False},
+                initiatives_cache.date_to_timestamp(datetime.date(2025, 10, 7)),
+            )
+        with freeze_local("2025-10-06 23:59:59"):
+            assert cache.get("package") == {"success": False}
+        with freeze_local("2025-10-07 00:00:00"):
+            assert cache.get("package") is None
+
+    @pytest.mark.skipif(not hasattr(time, "tzset"), reason="needs time.tzset")
+    @pytest.mark.usefixtures("central_european_time")
+    def test_expires_at_across_dst(self):
+        cache = initiatives_cache.ExpiringCache(86400 * 30, 10)
+
+        with freeze_local("2026-03-25 12:00:00"):
+            cache.set(
+                "package",
+                {"success": False},
+                initiatives_cache.date_to_timestamp(datetime.date(2026, 4, 1)),
+            )
+        # midnight CEST, an hour earlier in UTC than the week before
+        with freeze_time("2026-03-31 21:59:59"):
+            assert cache.get("package") == {"success": False}
+        with freeze_time("2026-03-31 22:00:00"):
+            assert cache.get("package") is None
+
+    def test_disabled(self):
+        cache = initiatives_cache.ExpiringCache(0, 10)
+
+        cache.set("package", {"success": False})
+
+        assert cache.get("package") is None
+
+    def test_evicts_oldest(self):
+        cache = initiatives_cache.ExpiringCache(60, 2)
+
+        cache.set("first", 1)
+        cache.set("second", 2)
+        cache.set("third", 3)
+
+        assert len(cache) == 2
+        assert cache.get("first") is None
+        assert cache.get("third") == 3
+
+    def test_invalidate(self):
+        cache = initiatives_cache.ExpiringCache(60, 10)
+
+        cache.set("package", {"success": False})
+        cache.invalidate("package")
+
+        assert cache.get("package") is None
+
+    def test_invalidate_where(self):
+        cache = initiatives_cache.ExpiringCache(60, 10)
+
+        cache.set(("someone", "package"), 1)
+        cache.set(("someone", "other package"), 2)
+        cache.set(("someone else", "package"), 3)
+        cache.invalidate_where(lambda key: key[1] == "package")
+
+        assert cache.get(("someone", "package")) is None
+        assert cache.get(("someone", "other package")) == 2
+        assert cache.get(("someone else", "package")) is None
+
+
+class TestSingleFlight(object):
+    def _run_concurrently(self, single_flight, key, fn, threads=8):
+        results = []
+        errors = []
+        barrier = threading.Barrier(threads)
+
+        def caller():
+            barrier.wait()
+            try:
+                results.append(single_flight.do(key, fn))
+            except Exception as e:
+                errors.append(e)
+
+        callers = [threading.Thread(target=caller) for i in range(threads)]
+        for thread in callers:
+            thread.start()
+        for thread in callers:
+            thread.join()
+        return results, errors
+
+    def test_coalesces_concurrent_calls(self):
+        single_flight = initiatives_cache.SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def lookup():
+            calls.append(1)
+            # hold the call open until the other threads are waiting on it
+            release.wait(5)
+            return {"org"}
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        results, errors = self._run_concurrently(single_flight, "user", lookup)
+
+        assert len(calls) == 1
+        assert single_flight.shared == 7
+        assert results == [{"org"}] * 8
+        assert errors == []
+
+    def test_shares_exceptions(self):
+        single_flight = initiatives_cache.SingleFlight()
+        release = threading.Event()
+
+        def lookup():
+            release.wait(5)
+            raise ValueError("lookup failed")
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        results, errors = self._run_concurrently(single_flight, "user", lookup)
+
+        assert results == []
+        assert len(errors) == 8
+        assert all(isinstance(e, ValueError) for e in errors)
+
+    def test_sequential_calls_are_not_coalesced(self):
+        single_flight = initiatives_cache.SingleFlight()
+        calls = []
+
+        def lookup():
+            calls.append(1)
+            return len(calls)
+
+        assert single_flight.do("user", lookup) == 1
+        assert single_flight.do("user", lookup) == 2
+        assert single_flight.shared == 0
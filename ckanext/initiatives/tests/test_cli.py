@@ -0,0 +1,233 @@
+"""
+Tests for cli.py.
+"""
+import pytest
+
+import ckan.model as model
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+import ckanext.initiatives.cache as initiatives_cache
+import ckanext.initiatives.cli as initiatives_cli
+import ckanext.initiatives.logic as initiatives_logic
+
+EMBARGO_POLICY = "organization_member_after_embargo:date_of_transfer:365:consortium"
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+class TestSetPolicy(object):
+    @pytest.mark.ckan_config("ckanext.initiatives.anonymous_cache.ttl", "3600")
+    def test_organization(self, cli):
+        owner_org = factories.Organization()
+        packages = [factories.Dataset(owner_org=owner_org["id"]) for _ in range(3)]
+        other_package = factories.Dataset()
+        initiatives_cache.anonymous_decisions.set(packages[0]["id"], {"success": False})
+
+        result = cli.invoke(
+            initiatives_cli.initiatives,
+            [
+                "set-policy",
+                "public",
+                "--organization",
+                owner_org["name"],
+                "--batch-size",
+                "2",
+            ],
+        )
+
+        assert result.exit_code == 0, result.output
+        assert "packages selected: 3" in result.output
+        for package in packages:
+            shown = helpers.call_action("package_show", id=package["id"])
+            assert (
+                initiatives_logic.get_key_maybe_extras(shown, "resource_permissions")
+                == "public"
+            )
+            assert shown["metadata_modified"] > package["metadata_modified"]
+        shown = helpers.call_action("package_show", id=other_package["id"])
+        assert not initiatives_logic.get_key_maybe_extras(
+            shown, "resource_permissions"
+        )
+        assert initiatives_cache.anonymous_decisions.get(packages[0]["id"]) is None
+        # the cache is on, but the other workers' are not invalidated
+        assert "warning: only this command's caches are invalidated" in result.output
+
+        # reindexed
+        found = helpers.call_action(
+            "package_search", q="id:%s" % packages[0]["id"], include_private=True
+        )["results"]
+        assert (
+            initiatives_logic.get_key_maybe_extras(found[0], "resource_permissions")
+            == "public"
+        )
+
+    @pytest.mark.ckan_config("ckanext.initiatives.hierarchy_cache.ttl", "0")
+    def test_failed_batch_reindexes_committed(self, cli, monkeypatch):
+        owner_org = factories.Organization()
+        for _ in range(3):
+            factories.Dataset(owner_org=owner_org["id"])
+        set_extras = initiatives_cli._set_extras
+        batches = []
+
+        def fail_second_batch(package_ids, extras):
+            batches.append(package_ids)
+            if len(batches) == 2:
+                raise RuntimeError("database went away")
+            set_extras(package_ids, extras)
+
+        monkeypatch.setattr(initiatives_cli, "_set_extras", fail_second_batch)
+
+        result = cli.invoke(
+            initiatives_cli.initiatives,
+            [
+                "set-policy",
+                "public",
+                "--organization",
+                owner_org["id"],
+                "--batch-size",
+                "2",
+            ],
+        )
+
+        assert result.exit_code != 0
+        assert "failed after updating 2 of 3 packages" in result.output
+        assert "warning" not in result.output
+        for package_id in batches[0]:
+            found = helpers.call_action(
+                "package_search", q="id:%s" % package_id, include_private=True
+            )["results"]
+            assert (
+                initiatives_logic.get_key_maybe_extras(found[0], "resource_permissions")
+                == "public"
+            )
+
+    @pytest.mark.ckan_config("ckanext.initiatives.hierarchy_cache.ttl", "0")
+    def test_failed_reindex_keeps_batch_error(self, cli, monkeypatch):
+        owner_org = factories.Organization()
+        for _ in range(3):
+            factories.Dataset(owner_org=owner_org["id"])
+        set_extras = initiatives_cli._set_extras
+        batches = []
+
+        def fail_second_batch(package_ids, extras):
+            batches.append(package_ids)
+            if len(batches) == 2:
+                raise RuntimeError("database went away")
+            set_extras(package_ids, extras)
+
+        def fail_reindex(package_ids):
+            raise RuntimeError("solr went away")
+
+        monkeypatch.setattr(initiatives_cli, "_set_extras", fail_second_batch)
+        monkeypatch.setattr(initiatives_cli, "_reindex", fail_reindex)
+
+        result = cli.invoke(
+            initiatives_cli.initiatives,
+            [
+                "set-policy",
+                "public",
+                "--organization",
+                owner_org["id"],
+                "--batch-size",
+                "2",
+            ],
+        )
+
+        assert result.exit_code != 0
+        assert str(result.exception) == "database went away"
+
+    def test_invalid_batch_size(self, cli, monkeypatch):
+        owner_org = factories.Organization()
+        monkeypatch.setattr(
+            initiatives_cli,
+            "_select_package_ids",
+            lambda *args: pytest.fail("packages selected"),
+        )
+
+        for batch_size in ("0", "-1"):
+            result = cli.invoke(
+                initiatives_cli.initiatives,
+                [
+                    "set-policy",
+                    "public",
+                    "--organization",
+                    owner_org["id"],
+                    "--batch-size",
+                    batch_size,
+                ],
+            )
+
+            assert result.exit_code == 2, result.output
+
+    def test_replaces_policy(self, cli):
+        owner_org = factories.Organization()
+        package = factories.Dataset(
+            owner_org=owner_org["id"],
+            extras=[{"key": "resource_permissions", "value": "organization_member"}],
+        )
+
+        result = cli.invoke(
+            initiatives_cli.initiatives,
+            [
+                "set-policy",
+                EMBARGO_POLICY,
+                "--organization",
+                owner_org["id"],
+                "--embargo-date",
+                "2025-10-03",
+            ],
+        )
+
+        assert result.exit_code == 0, result.output
+        extras = dict(model.Package.get(package["id"]).extras)
+        assert extras["resource_permissions"] == EMBARGO_POLICY
+        assert extras["date_of_transfer"] == "2025-10-03"
+
+    def test_query(self, cli):
+        matching = factories.Dataset(title="Marine microbes")
+        other_package = factories.Dataset(title="Plant pathogens")
+
+        result = cli.invoke(
+            initiatives_cli.initiatives,
+            ["set-policy", "public", "--query", "title:marine"],
+        )
+
+        assert result.exit_code == 0, result.output
+        assert "packages selected: 1" in result.output
+        assert dict(model.Package.get(matching["id"]).extras) == {
+            "resource_permissions": "public"
+        }
+        assert dict(model.Package.get(other_package["id"]).extras) == {}
+
+    def test_invalid_policy(self, cli):
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+
+        for args in (
+            ["not_a_handler"],
+            ["organization_member:extra"],
+            # no embargo field to set
+            ["public", "--embargo-date", "2025-10-03"],
+            [EMBARGO_POLICY, "--embargo-date", "03/10/2025"],
+        ):
+            result = cli.invoke(
+                initiatives_cli.initiatives,
+                ["set-policy"] + args + ["--organization", owner_org["id"]],
+            )
+
+            assert result.exit_code != 0
+        assert dict(model.Package.get(package["id"]).extras) == {}
+
+    def test_dry_run(self, cli):
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+
+        result = cli.invoke(
+            initiatives_cli.initiatives,
+            ["set-policy", "public", "--organization", owner_org["id"], "--dry-run"],
+        )
+
+        assert result.exit_code == 0, result.output
+        assert "packages selected: 1" in result.output
+        assert dict(model.Package.get(package["id"]).extras) == {}
@@ -0,0 +1,143 @@
+"""
+Tests for explain.py.
+"""
+import pytest
+
+import ckan.logic as logic
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+import ckanext.initiatives.cache as initiatives_cache
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives")
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+class TestInitiativesExplainAccess(object):
+    def test_explain_access_embargoed(self):
+        sysadmin = factories.Sysadmin()
+        user = factories.User()
+        consortium_org = factories.Organization()
+        owner_org = factories.Organization(
+            users=[{"name": user["id"], "capacity": "member"}],
+            groups=[{"name": consortium_org["name"]}],
+        )
+        package = factories.Dataset(
+            owner_org=owner_org["id"],
+            extras=[
+                {
+                    "key": "resource_permissions",
+                    "value": "organization_member_after_embargo:date_of_transfer_to_archive:7:%s"
+                    % consortium_org["name"],
+                },
+                {"key": "date_of_transfer_to_archive", "value": "2025-09-30"},
+            ],
+        )
+        resource = factories.Resource(package_id=package["id"])
+
+        result = helpers.call_action(
+            "initiatives_explain_access",
+            {"user": sysadmin["name"], "ignore_auth": False},
+            user=user["name"],
+            resource_id=resource["id"],
+        )
+
+        steps = {step["step"]: step for step in result["steps"]}
+        assert [step["step"] for step in result["steps"]] == [
+            "package_update_check",
+            "decision_cache",
+            "policy_parse",
+            "membership_resolution",
+            "date_parsing",
+            "handler",
+        ]
+        for step in result["steps"]:
+            assert step["wall_ms"] >= 0
+            assert step["sql_statements"] >= 0
+        assert steps["package_update_check"]["result"] is False
+        assert steps["decision_cache"]["enabled"] is False
+        assert steps["decision_cache"]["result"] == "miss"
+        assert steps["policy_parse"]["handler"] == "organization_member_after_embargo"
+        assert steps["policy_parse"]["inherited"] is False
+        assert steps["membership_resolution"]["cache"] == "miss"
+        assert steps["membership_resolution"]["organization_show_calls"] == 1
+        assert consortium_org["name"] in steps["membership_resolution"]["org_names"]
+        assert steps["date_parsing"]["lift_date"] == "2025-10-07"
+        # the user belongs to the consortium through their organization's parent
+        assert result["decision"]["success"] is True
+        assert result["decision"]["reason"] == "consortium_member"
+        assert result["served_from"] == "evaluation"
+
+    def test_explain_access_editor(self):
+        sysadmin = factories.Sysadmin()
+        user = factories.User()
+        owner_org = factories.Organization(
+            users=[{"name": user["id"], "capacity": "editor"}]
+        )
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"])
+
+        result = helpers.call_action(
+            "initiatives_explain_access",
+            {"user": sysadmin["name"], "ignore_auth": False},
+            user=user["name"],
+            resource_id=resource["id"],
+        )
+
+        assert [step["step"] for step in result["steps"]] == ["package_update_check"]
+        assert result["decision"]["reason"] == "package_editor"
+
+    def test_explain_access_anonymous(self):
+        sysadmin = factories.Sysadmin()
+        package = factories.Dataset(owner_org=factories.Organization()["id"])
+        resource = factories.Resource(package_id=package["id"])
+
+        result = helpers.call_action(
+            "initiatives_explain_access",
+            {"user": sysadmin["name"], "ignore_auth": False},
+            resource_id=resource["id"],
+        )
+
+        # resource_show makes no editor check for anonymous users
+        assert [step["step"] for step in result["steps"]][:2] == [
+            "decision_cache",
+            "policy_parse",
+        ]
+        assert result["steps"][0]["cache"] == "anonymous_decisions"
+        assert result["decision"]["success"] is False
+
+    @pytest.mark.ckan_config("ckanext.initiatives.decision_cache.ttl", "3600")
+    def test_explain_access_cached_decision(self):
+        sysadmin = factories.Sysadmin()
+        user = factories.User()
+        package = factories.Dataset(owner_org=factories.Organization()["id"])
+        resource = factories.Resource(package_id=package["id"])
+        # a decision cached before the package's policy changed
+        initiatives_cache.user_decisions.set(
+            (user["name"], package["id"]), {"success": True, "reason": "public"}
+        )
+
+        result = helpers.call_action(
+            "initiatives_explain_access",
+            {"user": sysadmin["name"], "ignore_auth": False},
+            user=user["name"],
+            resource_id=resource["id"],
+        )
+
+        steps = {step["step"]: step for step in result["steps"]}
+        assert steps["decision_cache"]["enabled"] is True
+        assert steps["decision_cache"]["result"] == "hit"
+        assert steps["decision_cache"]["cached"]["reason"] == "public"
+        assert result["served_from"] == "cache"
+        assert result["decision"]["reason"] == "public"
+        assert result["evaluated_decision"]["reason"] == "not_organization_member"
+
+    def test_explain_access_sysadmin_only(self):
+        user = factories.User()
+        resource = factories.Resource()
+
+        with pytest.raises(logic.NotAuthorized):
+            helpers.call_action(
+                "initiatives_explain_access",
+                {"user": user["name"], "ignore_auth": False},
+                resource_id=resource["id"],
+            )
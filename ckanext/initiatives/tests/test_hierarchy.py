@@ -0,0 +1,107 @@
+"""
+Tests for hierarchy.py.
+"""
+import pytest
+
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+import ckanext.initiatives.hierarchy as initiatives_hierarchy
+import ckanext.initiatives.logic as initiatives_logic
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives")
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+class TestOrganizationHierarchy(object):
+    def test_default_policy(self):
+        consortium_org = factories.Organization(
+            extras=[{"key": "resource_permissions", "value": "public"}]
+        )
+        owner_org = factories.Organization(groups=[{"name": consortium_org["name"]}])
+        other_org = factories.Organization()
+        organizations = initiatives_hierarchy.organizations
+
+        assert organizations.default_policy(consortium_org["id"]) == "public"
+        assert organizations.default_policy(consortium_org["name"]) == "public"
+        # inherited from the parent
+        assert organizations.default_policy(owner_org["id"]) == "public"
+        assert organizations.parent_ids(owner_org["name"]) == [consortium_org["id"]]
+        assert organizations.default_policy(other_org["id"]) == ""
+        assert organizations.default_policy("missing") == ""
+
+    def test_package_inherits_default_policy(self):
+        user = factories.User()
+        owner_org = factories.Organization(
+            extras=[{"key": "resource_permissions", "value": "public"}]
+        )
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"])
+
+        result = initiatives_logic.initiatives_check_user_resource_access(
+            user["name"], resource, package
+        )
+
+        assert result.get("success") is True
+        assert result.get("reason") == "public"
+
+    def test_package_policy_overrides_default(self):
+        user = factories.User()
+        owner_org = factories.Organization(
+            extras=[{"key": "resource_permissions", "value": "public"}]
+        )
+        package = factories.Dataset(
+            owner_org=owner_org["id"],
+            extras=[{"key": "resource_permissions", "value": "organization_member"}],
+        )
+        resource = factories.Resource(package_id=package["id"])
+        package = helpers.call_action("package_show", id=package["id"])
+
+        result = initiatives_logic.initiatives_check_user_resource_access(
+            user["name"], resource, package
+        )
+
+        assert result.get("success") is False
+
+    def test_organization_update_invalidates(self):
+        owner_org = factories.Organization()
+        organizations = initiatives_hierarchy.organizations
+
+        assert organizations.default_policy(owner_org["id"]) == ""
+
+        helpers.call_action(
+            "organization_patch",
+            id=owner_org["id"],
+            extras=[{"key": "resource_permissions", "value": "public"}],
+        )
+
+        assert organizations.default_policy(owner_org["id"]) == "public"
+
+    def test_package_update_keeps_hierarchy(self):
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        organizations = initiatives_hierarchy.organizations
+        organizations.index()
+
+        helpers.call_action("package_patch", id=package["id"], notes="updated")
+
+        # IPackageController.edit is not taken for an organization change
+        assert organizations.loaded()
+
+    def test_parent_added(self):
+        consortium_org = factories.Organization(
+            extras=[{"key": "resource_permissions", "value": "public"}]
+        )
+        owner_org = factories.Organization()
+        organizations = initiatives_hierarchy.organizations
+
+        assert organizations.default_policy(owner_org["id"]) == ""
+
+        helpers.call_action(
+            "organization_patch",
+            id=owner_org["id"],
+            groups=[{"name": consortium_org["name"]}],
+        )
+
+        assert organizations.parent_ids(owner_org["id"]) == [consortium_org["id"]]
+        assert organizations.parent_ids(consortium_org["id"]) == []
+        assert organizations.default_policy(owner_org["id"]) == "public"
@@ -0,0 +1,156 @@
+"""
+Tests for invalidation.py.
+"""
+import json
+import time
+
+import pytest
+
+import ckan.logic as logic
+import ckan.model as model
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+import ckanext.initiatives.cache as initiatives_cache
+import ckanext.initiatives.invalidation as initiatives_invalidation
+
+
+@pytest.fixture
+def anonymous_cache(monkeypatch):
+    monkeypatch.setattr(initiatives_cache.anonymous_decisions, "ttl", 3600)
+    yield initiatives_cache.anonymous_decisions
+    initiatives_cache.anonymous_decisions.clear()
+
+
+@pytest.mark.usefixtures("anonymous_cache")
+class TestMemoryInvalidationBus(object):
+    def test_publish_reaches_other_workers(self):
+        channel = []
+        worker = initiatives_invalidation.MemoryInvalidationBus(channel)
+        other_worker = initiatives_invalidation.MemoryInvalidationBus(channel)
+        initiatives_cache.anonymous_decisions.set("package", {"success": False})
+
+        worker.publish("package", "package")
+
+        assert initiatives_cache.anonymous_decisions.get("package") is None
+        assert worker.stats()["published"] == 1
+        # a worker does not receive its own invalidations
+        assert worker.stats()["received"] == 0
+        stats = other_worker.stats()
+        assert stats["received"] == 1
+        assert stats["lag_last_ms"] is not None
+
+    def test_lag(self):
+        bus = initiatives_invalidation.MemoryInvalidationBus()
+
+        bus.receive(
+            {
+                "kind": "package",
+                "key": "package",
+                "sent_at": time.time() - 0.5,
+                "origin": "another worker",
+            }
+        )
+
+        stats = bus.stats()
+        assert stats["lag_last_ms"] >= 500
+        assert stats["lag_max_ms"] >= 500
+        assert stats["lag_mean_ms"] >= 500
+
+    def test_unknown_invalidation_ignored(self):
+        bus = initiatives_invalidation.MemoryInvalidationBus()
+
+        bus.receive({"kind": "unknown", "sent_at": time.time(), "origin": "another"})
+
+        assert bus.stats()["received"] == 0
+
+
+class _FakeRedis(object):
+    def __init__(self):
+        self.published = []
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+class TestRedisInvalidationBus(object):
+    def test_publish(self, monkeypatch):
+        import ckan.lib.redis
+
+        redis = _FakeRedis()
+        monkeypatch.setattr(ckan.lib.redis, "connect_to_redis", lambda: redis)
+        bus = initiatives_invalidation.RedisInvalidationBus("invalidate")
+
+        bus.publish("user", "someone")
+
+        ((channel, message),) = redis.published
+        assert channel == "invalidate"
+        message = json.loads(message)
+        assert message["kind"] == "user"
+        assert message["key"] == "someone"
+        assert message["origin"] == bus.origin
+
+    @pytest.mark.usefixtures("anonymous_cache")
+    def test_receive(self):
+        bus = initiatives_invalidation.RedisInvalidationBus("invalidate")
+        initiatives_cache.anonymous_decisions.set("package", {"success": False})
+
+        bus.receive(
+            {
+                "kind": "organizations",
+                "key": None,
+                "sent_at": time.time(),
+                "origin": "another worker",
+            }
+        )
+
+        assert initiatives_cache.anonymous_decisions.get("package") is None
+        assert bus.stats()["received"] == 1
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives")
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+class TestInvalidationStatus(object):
+    def test_sysadmin_only(self):
+        user = factories.User()
+
+        with pytest.raises(logic.NotAuthorized):
+            helpers.call_action(
+                "initiatives_invalidation_status",
+                {"user": user["name"], "ignore_auth": False},
+            )
+
+    def test_published(self):
+        sysadmin = factories.Sysadmin()
+        published = initiatives_invalidation.stats()["published"]
+
+        factories.Organization()
+
+        result = helpers.call_action(
+            "initiatives_invalidation_status",
+            {"user": sysadmin["name"], "ignore_auth": False},
+        )
+        assert result["bus"] == "memory"
+        assert result["published"] > published
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "anonymous_cache")
+class TestPublishAfterCommit(object):
+    def test_publish_after_commit(self):
+        initiatives_invalidation.publish_after_commit("package", "package")
+
+        # cached again before the change is committed
+        initiatives_cache.anonymous_decisions.set("package", {"success": True})
+        model.Session.commit()
+
+        assert initiatives_cache.anonymous_decisions.get("package") is None
+
+    def test_rollback_discards(self):
+        initiatives_invalidation.publish_after_commit("package", "package")
+        model.Session.rollback()
+
+        initiatives_cache.anonymous_decisions.set("package", {"success": True})
+        model.Session.commit()
+
+        assert initiatives_cache.anonymous_decisions.get("package") is not None
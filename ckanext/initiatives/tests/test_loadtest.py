@@ -0,0 +1,29 @@
+"""
+Runs the load test harness in loadtest.py.
+
+This is a small smoke run by default; set INITIATIVES_LOADTEST_THREADS and
+INITIATIVES_LOADTEST_REQUESTS to size a real run, and use `pytest -s` to see
+the report.
+"""
+import os
+
+import pytest
+
+from ckanext.initiatives.tests import loadtest
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives image_view")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index")
+def test_load(app):
+    threads = int(os.environ.get("INITIATIVES_LOADTEST_THREADS", 4))
+    requests_per_thread = int(os.environ.get("INITIATIVES_LOADTEST_REQUESTS", 10))
+
+    scenario = loadtest.build_scenario(datasets_per_policy=2, users_per_kind=2)
+    report = loadtest.run_load_test(
+        app, scenario, threads=threads, requests_per_thread=requests_per_thread
+    )
+    print(loadtest.format_report(report))
+
+    assert report["total"]["requests"] == threads * requests_per_thread
+    assert report["total"]["errors"] == 0
+    assert report["total"]["p50_ms"] <= report["total"]["p99_ms"]
@@ -330,3 +330,137 @@ class TestInitiativesLogic(object):
         )
 
         assert result.get("success") == True
+
+    def test_validate_resource_permissions(self):
+        assert initiatives_logic.validate_resource_permissions(
+            "organization_member_after_embargo:date_of_transfer:365:consortium"
+        ) == (
+            "organization_member_after_embargo",
+            ["date_of_transfer", "365", "consortium"],
+        )
+        assert initiatives_logic.validate_resource_permissions("public") == (
+            "public",
+            [],
+        )
+
+        for policy in (
+            "",
+            "unknown",
+            "public:extra",
+            "organization_member_after_embargo:date_of_transfer:365",
+            "organization_member_after_embargo:date_of_transfer:a year:consortium",
+        ):
+            with pytest.raises(ValueError):
+                initiatives_logic.validate_resource_permissions(policy)
+
+    @pytest.mark.usefixtures("clean_db")
+    def test_initiatives_decision_version_membership(self):
+        user = factories.User()
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"])
+
+        before = initiatives_logic.initiatives_decision_version(
+            user["name"], package["id"], resource["id"]
+        )
+
+        assert before == initiatives_logic.initiatives_decision_version(
+            user["name"], package["id"], resource["id"]
+        )
+
+        helpers.call_action(
+            "organization_member_create",
+            {"ignore_auth": True},
+            id=owner_org["id"],
+            username=user["name"],
+            role="member",
+        )
+
+        after = initiatives_logic.initiatives_decision_version(
+            user["name"], package["id"], resource["id"]
+        )
+
+        assert after != before
+
+    @pytest.mark.usefixtures("clean_db")
+    def test_initiatives_decision_version_parent(self):
+        user = factories.User()
+        consortium_org = factories.Organization()
+        owner_org = factories.Organization(
+            users=[{"name": user["id"], "capacity": "member"}]
+        )
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"])
+
+        before = initiatives_logic.initiatives_membership_version(user["name"])
+
+        # the user's organization joins the consortium
+        helpers.call_action(
+            "organization_patch",
+            id=owner_org["id"],
+            groups=[{"name": consortium_org["name"]}],
+        )
+
+        joined = initiatives_logic.initiatives_membership_version(user["name"])
+        assert joined != before
+
+        helpers.call_action("organization_patch", id=owner_org["id"], groups=[])
+
+        assert initiatives_logic.initiatives_membership_version(user["name"]) != joined
+
+    @pytest.mark.usefixtures("clean_db")
+    def test_initiatives_decision_version_embargo_lift(self):
+        user = factories.User()
+        owner_org = factories.Organization()
+        package = factories.Dataset(
+            owner_org=owner_org["id"],
+            extras=[
+                {
+                    "key": "resource_permissions",
+                    "value": "organization_member_after_embargo:date_of_transfer_to_archive:7:consortium",
+                },
+                {"key": "date_of_transfer_to_archive", "value": "2025-09-30"},
+            ],
+        )
+        resource = factories.Resource(package_id=package["id"])
+
+        with freeze_time("2025-10-03 23:30:00"):
+            embargoed = initiatives_logic.initiatives_decision_version(
+                user["name"], package["id"], resource["id"]
+            )
+
+        with freeze_time("2025-10-10 23:30:00"):
+            lifted = initiatives_logic.initiatives_decision_version(
+                user["name"], package["id"], resource["id"]
+            )
+
+        assert embargoed != lifted
+
+    def test_initiatives_decision_version_not_found(self):
+        assert (
+            initiatives_logic.initiatives_decision_version("", "missing", "missing")
+            is None
+        )
+
+    @pytest.mark.usefixtures("clean_db")
+    def test_initiatives_packages_extras(self):
+        package = factories.Dataset(
+            extras=[
+                {"key": "resource_permissions", "value": "public"},
+                {"key": "date_of_transfer", "value": "2025-10-03"},
+            ]
+        )
+        bare_package = factories.Dataset()
+
+        extras = initiatives_logic.initiatives_packages_extras(
+            [package["id"], bare_package["id"]]
+        )
+
+        assert extras == {
+            package["id"]: {
+                "resource_permissions": "public",
+                "date_of_transfer": "2025-10-03",
+            },
+            bare_package["id"]: {},
+        }
+        assert extras[package["id"]] == dict(model.Package.get(package["id"]).extras)
@@ -0,0 +1,154 @@
+"""
+Tests for membership_index.py.
+"""
+import sys
+
+import pytest
+
+import ckan.model as model
+import ckan.tests.factories as factories
+
+import ckanext.initiatives.logic as initiatives_logic
+import ckanext.initiatives.membership_index as initiatives_membership_index
+
+
+class TestMembershipIndex(object):
+    def _index(self):
+        index = initiatives_membership_index.MembershipIndex()
+        consortium = index.intern("consortium-id", "consortium")
+        owner = index.intern("owner-id", "owner")
+        index.intern("other-id", "other")
+        index.add_user("alice", [owner], [consortium])
+        index.add_user("bob", [], [])
+        return index
+
+    def test_user_organizations(self):
+        index = self._index()
+
+        user_orgs = index.user_organizations("alice")
+
+        assert "owner-id" in user_orgs.org_ids
+        # ids and names are not mixed up
+        assert "owner" not in user_orgs.org_ids
+        assert "owner-id" not in user_orgs.org_names
+        assert "consortium-id" not in user_orgs.org_ids
+        assert "other-id" not in user_orgs.org_ids
+        assert "consortium" in user_orgs.org_names
+        assert "owner" in user_orgs.org_names
+        assert "missing" not in user_orgs.org_names
+        assert sorted(user_orgs.org_names) == ["consortium", "owner"]
+        assert list(user_orgs.org_ids) == ["owner-id"]
+
+    def test_unknown_user(self):
+        index = self._index()
+
+        assert index.user_organizations("carol") is None
+        assert "owner-id" not in index.user_organizations("bob").org_ids
+
+    def test_member_of(self):
+        index = self._index()
+
+        assert index.member_of("alice", "owner")
+        assert index.member_of("alice", "owner-id")
+        assert not index.member_of("alice", "consortium")
+        assert not index.member_of("carol", "owner")
+
+    def test_footprint(self):
+        # 20k users in 500 organizations, against the same memberships held
+        # as sets of strings
+        index = initiatives_membership_index.MembershipIndex()
+        orgs = [("%032x" % i, "organization-%d" % i) for i in range(500)]
+        for org_id, org_name in orgs:
+            index.intern(org_id, org_name)
+        sets = 0
+        for i in range(20000):
+            mine = [orgs[(i * 7 + j * 131) % 500] for j in range(3)]
+            index.add_user(
+                "user-%d" % i,
+                [index.bits.by_id[org_id] for org_id, org_name in mine],
+                [],
+            )
+            org_ids = set(org_id for org_id, org_name in mine)
+            org_names = set(org_name for org_id, org_name in mine)
+            sets += sys.getsizeof(org_ids) + sys.getsizeof(org_names)
+            sets += sum(sys.getsizeof(key) for key in org_ids | org_names)
+
+        footprint = index.footprint()
+
+        assert footprint["total"] == footprint["interning"] + footprint["users"]
+        assert footprint["total"] * 2 < sets
+
+
+class TestIndexHolder(object):
+    def test_invalidated_while_loading(self, monkeypatch):
+        holder = initiatives_membership_index._IndexHolder(300)
+        loaded = []
+
+        def load():
+            # a change is committed and invalidated mid-load
+            holder.invalidate()
+            loaded.append(initiatives_membership_index.MembershipIndex())
+            return loaded[-1]
+
+        monkeypatch.setattr(
+            initiatives_membership_index.MembershipIndex, "load", staticmethod(load)
+        )
+
+        first = holder.index()
+        second = holder.index()
+
+        # the index loaded from before the change was used, not kept
+        assert first is loaded[0]
+        assert second is loaded[1]
+        assert len(loaded) == 2
+
+    def test_kept(self, monkeypatch):
+        holder = initiatives_membership_index._IndexHolder(300)
+        monkeypatch.setattr(
+            initiatives_membership_index.MembershipIndex,
+            "load",
+            staticmethod(initiatives_membership_index.MembershipIndex),
+        )
+
+        assert holder.index() is holder.index()
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives")
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+def test_load_matches_user_organizations():
+    member = factories.User()
+    admin = factories.User()
+    outsider = factories.User()
+    sysadmin = factories.Sysadmin()
+    consortium_org = factories.Organization()
+    owner_org = factories.Organization(
+        users=[
+            {"name": member["id"], "capacity": "member"},
+            {"name": admin["id"], "capacity": "admin"},
+        ],
+        groups=[{"name": consortium_org["name"]}],
+    )
+    sub_org = factories.Organization(groups=[{"name": owner_org["name"]}])
+    # consortia which are not active organizations
+    group_consortium = factories.Group()
+    deleted_consortium = factories.Organization()
+    factories.Organization(
+        users=[{"name": outsider["id"], "capacity": "member"}],
+        groups=[
+            {"name": group_consortium["name"]},
+            {"name": deleted_consortium["name"]},
+        ],
+    )
+    model.Group.get(deleted_consortium["id"]).state = "deleted"
+    model.repo.commit()
+
+    index = initiatives_membership_index.MembershipIndex.load()
+
+    for user in (member, admin, outsider, sysadmin):
+        expected = initiatives_logic.UserOrganizations(user["name"])
+        indexed = index.user_organizations(user["name"])
+        assert set(indexed.org_ids) == expected.org_ids
+        assert set(indexed.org_names) == expected.org_names
+    outsider_names = set(index.user_organizations(outsider["name"]).org_names)
+    assert group_consortium["name"] in outsider_names
+    assert deleted_consortium["name"] in outsider_names
@@ -53,8 +53,10 @@ import ckan.model as model
 import ckan.tests.factories as factories
 import ckan.tests.helpers as helpers
 import ckan.plugins.toolkit as tk
+import ckanext.initiatives.audit as initiatives_audit
 import ckanext.initiatives.plugins as plugins
 
+from ckan.common import g
 from ckan.plugins import plugin_loaded
 
 
@@ -67,4 +69,213 @@ def test_plugin():
 @pytest.mark.ckan_config("ckan.plugins", "initiatives")
 @pytest.mark.usefixtures("with_plugins")
 class TestInitiativesPlugin(object):
-    pass
+    @pytest.mark.usefixtures("clean_db", "clean_index", "with_request_context")
+    def test_after_dataset_search_annotates_resources(self):
+        user = factories.User()
+        g.user = user["name"]
+        g.userobj = model.User.by_name(user["name"])
+
+        member_org = factories.Organization(
+            users=[{"name": user["id"], "capacity": "member"}]
+        )
+        other_org = factories.Organization()
+        member_package = factories.Dataset(owner_org=member_org["id"])
+        other_package = factories.Dataset(owner_org=other_org["id"])
+        public_package = factories.Dataset(
+            owner_org=other_org["id"],
+            extras=[{"key": "resource_permissions", "value": "public"}],
+        )
+        for package in (member_package, other_package, public_package):
+            factories.Resource(package_id=package["id"])
+
+        result = helpers.call_action(
+            "package_search", {"user": user["name"], "ignore_auth": False}, q="*:*"
+        )
+
+        resources = {
+            package["id"]: package["resources"][0] for package in result["results"]
+        }
+        assert resources[member_package["id"]]["initiatives_accessible"] is True
+        assert (
+            resources[member_package["id"]]["initiatives_access_reason"]
+            == "organization_member"
+        )
+        assert resources[other_package["id"]]["initiatives_accessible"] is False
+        assert (
+            resources[other_package["id"]]["initiatives_access_reason"]
+            == "not_organization_member"
+        )
+        assert resources[public_package["id"]]["initiatives_accessible"] is True
+        assert resources[public_package["id"]]["initiatives_access_reason"] == "public"
+
+    @pytest.mark.usefixtures("clean_db", "clean_index")
+    def test_after_dataset_search_anonymous(self):
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        factories.Resource(package_id=package["id"])
+
+        result = helpers.call_action("package_search", {"ignore_auth": False}, q="*:*")
+
+        resource = result["results"][0]["resources"][0]
+        assert resource["initiatives_accessible"] is False
+        assert resource["initiatives_access_reason"] == "not_logged_in"
+
+    @pytest.mark.usefixtures("clean_db", "clean_index", "with_request_context")
+    def test_after_dataset_search_uses_callers_context(self):
+        user = factories.User()
+        editor = factories.User()
+        # the logged in user is not who the search is made for
+        g.user = user["name"]
+        g.userobj = model.User.by_name(user["name"])
+        owner_org = factories.Organization(
+            users=[
+                {"name": user["id"], "capacity": "member"},
+                {"name": editor["id"], "capacity": "editor"},
+            ]
+        )
+        package = factories.Dataset(owner_org=owner_org["id"])
+        factories.Resource(package_id=package["id"])
+
+        result = helpers.call_action(
+            "package_search", {"user": editor["name"], "ignore_auth": False}, q="*:*"
+        )
+
+        resource = result["results"][0]["resources"][0]
+        assert resource["initiatives_access_reason"] == "package_editor"
+
+        # searches made with ignore_auth are not annotated
+        result = helpers.call_action(
+            "package_search", {"user": user["name"], "ignore_auth": True}, q="*:*"
+        )
+
+        assert "initiatives_accessible" not in result["results"][0]["resources"][0]
+
+    @pytest.mark.usefixtures("clean_db")
+    def test_after_dataset_show_annotates_resources(self):
+        user = factories.User()
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"], url="http://a.b/c")
+
+        result = helpers.call_action(
+            "package_show",
+            {"user": user["name"], "ignore_auth": False, "api_version": 3},
+            id=package["id"],
+        )
+
+        assert result["resources"][0]["initiatives_accessible"] is False
+        assert (
+            result["resources"][0]["initiatives_access_reason"]
+            == "not_organization_member"
+        )
+        # URLs are only redacted when configured
+        assert result["resources"][0]["url"] == "http://a.b/c"
+
+    @pytest.mark.usefixtures("clean_db")
+    @pytest.mark.ckan_config("ckanext.initiatives.redact_restricted_urls", "true")
+    def test_after_dataset_show_redacts_urls(self):
+        user = factories.User()
+        member = factories.User()
+        owner_org = factories.Organization(
+            users=[{"name": member["id"], "capacity": "member"}]
+        )
+        package = factories.Dataset(owner_org=owner_org["id"])
+        factories.Resource(package_id=package["id"], url="http://a.b/c")
+
+        result = helpers.call_action(
+            "package_show",
+            {"user": user["name"], "ignore_auth": False, "api_version": 3},
+            id=package["id"],
+        )
+
+        assert result["resources"][0]["url"] == ""
+
+        result = helpers.call_action(
+            "package_show",
+            {"user": member["name"], "ignore_auth": False, "api_version": 3},
+            id=package["id"],
+        )
+
+        assert result["resources"][0]["initiatives_accessible"] is True
+        assert result["resources"][0]["url"] == "http://a.b/c"
+
+    @pytest.mark.usefixtures("clean_db")
+    @pytest.mark.ckan_config("ckanext.initiatives.redact_restricted_urls", "true")
+    def test_after_dataset_show_for_update(self):
+        user = factories.User()
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        factories.Resource(package_id=package["id"], url="http://a.b/c")
+
+        result = helpers.call_action(
+            "package_show",
+            {
+                "user": user["name"],
+                "ignore_auth": False,
+                "api_version": 3,
+                "for_update": True,
+            },
+            id=package["id"],
+        )
+
+        assert result["resources"][0]["url"] == "http://a.b/c"
+        assert "initiatives_accessible" not in result["resources"][0]
+
+    @pytest.mark.usefixtures("clean_db")
+    def test_after_dataset_show_internal(self):
+        user = factories.User()
+        package = factories.Dataset()
+        factories.Resource(package_id=package["id"])
+
+        # e.g. package_show called by another action, or by a plugin
+        result = helpers.call_action(
+            "package_show", {"user": user["name"], "ignore_auth": False}, id=package["id"]
+        )
+
+        assert "initiatives_accessible" not in result["resources"][0]
+
+    @pytest.mark.usefixtures("clean_db")
+    def test_annotations_not_saved(self):
+        editor = factories.User()
+        owner_org = factories.Organization(
+            users=[{"name": editor["id"], "capacity": "editor"}]
+        )
+        package = factories.Dataset(owner_org=owner_org["id"])
+        factories.Resource(package_id=package["id"])
+        context = {"user": editor["name"], "ignore_auth": False, "api_version": 3}
+
+        shown = helpers.call_action("package_show", dict(context), id=package["id"])
+        assert shown["resources"][0]["initiatives_accessible"] is True
+
+        shown["notes"] = "edited"
+        helpers.call_action("package_update", dict(context), **shown)
+        resource = helpers.call_action(
+            "resource_show", dict(context), id=shown["resources"][0]["id"]
+        )
+        helpers.call_action("resource_update", dict(context), **resource)
+
+        saved = helpers.call_action("package_show", {}, id=package["id"])
+        assert saved["notes"] == "edited"
+        assert "initiatives_accessible" not in saved["resources"][0]
+        assert "initiatives_access_reason" not in saved["resources"][0]
+
+    @pytest.mark.usefixtures("clean_db")
+    def test_resource_show_decides_once(self, tmp_path):
+        user = factories.User()
+        package = factories.Dataset(
+            extras=[{"key": "resource_permissions", "value": "public"}]
+        )
+        resource = factories.Resource(package_id=package["id"])
+        path = tmp_path / "audit.jsonl"
+        initiatives_audit.configure({"ckanext.initiatives.audit.path": str(path)})
+        try:
+            helpers.call_action(
+                "resource_show",
+                {"user": user["name"], "ignore_auth": False, "api_version": 3},
+                id=resource["id"],
+            )
+        finally:
+            initiatives_audit.stop()
+
+        with open(str(path)) as f:
+            assert len(f.readlines()) == 1
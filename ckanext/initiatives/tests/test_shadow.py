@@ -0,0 +1,181 @@
+"""
+Tests for shadow.py.
+"""
+import pytest
+
+import ckan.logic as logic
+import ckan.model as model
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+import ckanext.initiatives.cache as initiatives_cache
+import ckanext.initiatives.logic as initiatives_logic
+import ckanext.initiatives.shadow as initiatives_shadow
+
+
+@pytest.fixture
+def shadow_everything():
+    initiatives_shadow.configure({"ckanext.initiatives.shadow.sample_rate": "1"})
+    yield
+    initiatives_shadow.configure({})
+
+
+class TestCompare(object):
+    def test_off(self):
+        initiatives_shadow.configure({})
+        calls = []
+
+        def reference():
+            calls.append(1)
+            return {"success": False}
+
+        result = initiatives_shadow.compare(
+            "path", reference, lambda: {"success": True}, {}
+        )
+
+        assert result == {"success": True}
+        assert calls == []
+
+    def test_not_sampled(self, monkeypatch):
+        initiatives_shadow.configure({"ckanext.initiatives.shadow.sample_rate": "0.5"})
+        monkeypatch.setattr(initiatives_shadow.random, "random", lambda: 0.9)
+        calls = []
+
+        def optimized():
+            calls.append(1)
+            return {"success": True}
+
+        try:
+            result = initiatives_shadow.compare(
+                "path", lambda: {"success": False}, optimized, {}
+            )
+        finally:
+            initiatives_shadow.configure({})
+
+        # the reference decision, always
+        assert result == {"success": False}
+        assert calls == []
+
+    @pytest.mark.usefixtures("shadow_everything")
+    def test_reference_evaluation(self):
+        seen = []
+
+        def reference():
+            seen.append(getattr(initiatives_logic._reference, "active", False))
+            return {"success": True}
+
+        initiatives_shadow.compare("path", reference, lambda: {"success": True}, {})
+
+        assert seen == [True]
+        assert not getattr(initiatives_logic._reference, "active", False)
+
+    @pytest.mark.usefixtures("shadow_everything")
+    def test_match(self):
+        result = initiatives_shadow.compare(
+            "path",
+            lambda: {"success": True, "reason": "public"},
+            lambda: {"success": True},
+            {"user": "alice"},
+        )
+
+        assert result == {"success": True, "reason": "public"}
+        report = initiatives_shadow.stats.report()
+        assert report["paths"]["path"]["compared"] == 1
+        assert report["paths"]["path"]["mismatched"] == 0
+        assert report["mismatches"] == []
+
+    @pytest.mark.usefixtures("shadow_everything")
+    def test_mismatch(self):
+        result = initiatives_shadow.compare(
+            "path",
+            lambda: [{"success": True}, {"success": False}],
+            lambda: [{"success": True}, {"success": True}],
+            {"user": "alice"},
+        )
+
+        assert result == [{"success": True}, {"success": False}]
+        report = initiatives_shadow.stats.report()
+        assert report["paths"]["path"]["mismatched"] == 1
+        assert report["mismatches"][0]["user"] == "alice"
+        assert report["mismatches"][0]["path"] == "path"
+        assert report["mismatches"][0]["optimized"] == [
+            {"success": True},
+            {"success": True},
+        ]
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives")
+@pytest.mark.usefixtures("with_plugins", "clean_db", "shadow_everything")
+class TestShadowPaths(object):
+    @pytest.mark.ckan_config("ckanext.initiatives.anonymous_cache.ttl", "3600")
+    def test_anonymous_cache_returns_reference(self):
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"])
+        # a stale cached grant
+        initiatives_cache.anonymous_decisions.set(package["id"], {"success": True})
+
+        with pytest.raises(logic.NotAuthorized):
+            helpers.call_auth(
+                "resource_show",
+                context={"user": "", "model": model},
+                data_dict={"id": resource["id"]},
+            )
+
+        report = initiatives_shadow.stats.report()
+        assert report["paths"]["anonymous_cache"]["mismatched"] == 1
+        assert report["mismatches"][0]["package_id"] == package["id"]
+
+    @pytest.mark.ckan_config("ckanext.initiatives.membership_cache.ttl", "300")
+    def test_reference_resolves_memberships_afresh(self):
+        user = factories.User()
+        owner_org = factories.Organization()
+        # a stale cached membership
+        initiatives_logic.get_user_organizations(user["name"]).org_ids.add(
+            owner_org["id"]
+        )
+
+        assert owner_org["id"] in initiatives_logic.get_user_organizations(
+            user["name"]
+        ).org_ids
+        with initiatives_logic.reference_evaluation():
+            assert owner_org["id"] not in initiatives_logic.get_user_organizations(
+                user["name"]
+            ).org_ids
+
+    @pytest.mark.ckan_config("ckanext.initiatives.membership_cache.ttl", "300")
+    def test_cache_miss_returns_reference(self):
+        user = factories.User()
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"])
+        # a stale cached membership, with the decision cache off
+        initiatives_logic.get_user_organizations(user["name"]).org_ids.add(
+            owner_org["id"]
+        )
+
+        with pytest.raises(logic.NotAuthorized):
+            helpers.call_auth(
+                "resource_show",
+                context={"user": user["name"], "model": model},
+                data_dict={"id": resource["id"]},
+            )
+
+        report = initiatives_shadow.stats.report()
+        assert report["paths"]["decision_cache_miss"]["mismatched"] == 1
+        assert report["mismatches"][0]["user"] == user["name"]
+
+    def test_shadow_report_sysadmin_only(self):
+        user = factories.User()
+        sysadmin = factories.Sysadmin()
+
+        with pytest.raises(logic.NotAuthorized):
+            helpers.call_action(
+                "initiatives_shadow_report", {"user": user["name"], "ignore_auth": False}
+            )
+
+        report = helpers.call_action(
+            "initiatives_shadow_report", {"user": sysadmin["name"], "ignore_auth": False}
+        )
+
+        assert "paths" in report
@@ -0,0 +1,115 @@
+"""
+Tests for views.py.
+"""
+import pytest
+
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+import ckan.plugins.toolkit as tk
+
+import ckanext.initiatives.logic as initiatives_logic
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives")
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+class TestInitiativesViews(object):
+    def test_check_access_etag(self, app):
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"])
+
+        url = tk.url_for(
+            "initiatives.check_access",
+            package_id=package["id"],
+            resource_id=resource["id"],
+        )
+
+        response = app.get(url)
+
+        assert response.status_code == 200
+        assert response.json["result"]["success"] is False
+        etag = response.headers["ETag"]
+        assert etag
+
+        response = app.get(url, headers={"If-None-Match": etag})
+
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+
+    def test_check_access_etag_changes_with_package(self, app):
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"])
+
+        url = tk.url_for(
+            "initiatives.check_access",
+            package_id=package["id"],
+            resource_id=resource["id"],
+        )
+
+        etag = app.get(url).headers["ETag"]
+
+        tk.get_action("package_patch")(
+            {"ignore_auth": True},
+            {"id": package["id"], "notes": "updated"},
+        )
+
+        response = app.get(url, headers={"If-None-Match": etag})
+
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    def test_check_access_missing_resource_id(self, app):
+        package = factories.Dataset()
+
+        url = tk.url_for("initiatives.check_access", package_id=package["id"])
+
+        response = app.get(url, status=409)
+
+        assert response.json["success"] is False
+        assert "ETag" not in response.headers
+
+    def test_check_access_private_package(self, app):
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"], private=True)
+        resource = factories.Resource(package_id=package["id"])
+
+        url = tk.url_for(
+            "initiatives.check_access",
+            package_id=package["id"],
+            resource_id=resource["id"],
+        )
+
+        response = app.get(url, status=403)
+
+        assert response.json["success"] is False
+        assert "ETag" not in response.headers
+
+    @pytest.mark.ckan_config("ckanext.initiatives.membership_cache.ttl", "300")
+    def test_check_access_resolves_memberships_afresh(self, app):
+        user = factories.User()
+        owner_org = factories.Organization()
+        package = factories.Dataset(owner_org=owner_org["id"])
+        resource = factories.Resource(package_id=package["id"])
+        token = helpers.call_action(
+            "api_token_create",
+            {"user": user["name"], "ignore_auth": True},
+            user=user["name"],
+            name="test",
+        )["token"]
+        # a stale cached membership
+        initiatives_logic.get_user_organizations(user["name"]).org_ids.add(
+            owner_org["id"]
+        )
+
+        url = tk.url_for(
+            "initiatives.check_access",
+            package_id=package["id"],
+            resource_id=resource["id"],
+        )
+
+        response = app.get(url, headers={"Authorization": token})
+
+        # the decision agrees with the ETag, both from the database
+        assert response.json["result"]["success"] is False
+        assert response.headers["ETag"]
@@ -0,0 +1,114 @@
+"""
+Tests for warmup.py.
+"""
+import pytest
+
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
+
+import ckanext.initiatives.logic as initiatives_logic
+import ckanext.initiatives.warmup as initiatives_warmup
+
+
+@pytest.mark.ckan_config("ckan.plugins", "initiatives")
+@pytest.mark.ckan_config("ckanext.initiatives.membership_cache.ttl", "300")
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+class TestWarmUp(object):
+    def test_run(self):
+        owner_org = factories.Organization(
+            extras=[{"key": "resource_permissions", "value": "public"}]
+        )
+        factories.Dataset(
+            owner_org=owner_org["id"],
+            extras=[{"key": "resource_permissions", "value": "organization_member"}],
+        )
+        initiatives_logic.compile_resource_permissions.cache_clear()
+        warm_up = initiatives_warmup.WarmUp()
+
+        assert warm_up.status()["state"] == "pending"
+        assert warm_up.status()["ready"] is False
+
+        warm_up.run()
+
+        status = warm_up.status()
+        assert status["state"] == "finished"
+        assert status["finished"] is True
+        assert status["ready"] is True
+        steps = {step["step"]: step for step in status["steps"]}
+        assert steps["organization_hierarchy"]["organizations"] == 1
+        # the package's own policy, the organization's default and no policy
+        assert steps["policies"]["policies"] == 3
+        assert initiatives_logic.compile_resource_permissions.cache_info().currsize == 3
+        assert "memberships" in steps
+
+    def test_started_per_process(self, monkeypatch):
+        started = []
+
+        def start(warm_up, app=None):
+            warm_up.pid = initiatives_warmup.os.getpid()
+            started.append(warm_up)
+
+        monkeypatch.setattr(initiatives_warmup.WarmUp, "start", start)
+        monkeypatch.setattr(initiatives_warmup, "current", None)
+        monkeypatch.setattr(initiatives_warmup, "_settings", None)
+
+        warm_up = initiatives_warmup.start(None, {"ckanext.initiatives.warmup": "true"})
+
+        assert started == [warm_up]
+        assert initiatives_warmup.ensure_started() is warm_up
+
+        # as in a worker forked after the warm-up started
+        warm_up.pid = -1
+        warm_up.state = "running"
+
+        restarted = initiatives_warmup.ensure_started()
+
+        assert restarted is not warm_up
+        assert started == [warm_up, restarted]
+        assert initiatives_warmup.status()["state"] == "pending"
+
+    def test_status_action(self):
+        result = helpers.call_action("initiatives_warmup_status")
+
+        assert result["state"] in ("disabled", "pending", "running", "finished")
+        assert "ready" in result
+
+    def test_status_action_details_sysadmin_only(self, monkeypatch):
+        warm_up = initiatives_warmup.WarmUp()
+        warm_up.state = "failed"
+        warm_up.error = "connection to server at 10.0.0.5 failed"
+        monkeypatch.setattr(initiatives_warmup, "current", warm_up)
+        monkeypatch.setattr(initiatives_warmup, "ensure_started", lambda: warm_up)
+        sysadmin = factories.Sysadmin()
+
+        result = helpers.call_action(
+            "initiatives_warmup_status", {"user": "", "ignore_auth": False}
+        )
+
+        assert result == {"state": "failed", "ready": True}
+
+        result = helpers.call_action(
+            "initiatives_warmup_status", {"user": sysadmin["name"], "ignore_auth": False}
+        )
+
+        assert result["error"] == "connection to server at 10.0.0.5 failed"
+        assert result["steps"] == []
+
+    def test_member_create_invalidates_memberships(self):
+        user = factories.User()
+        owner_org = factories.Organization()
+
+        assert owner_org["id"] not in initiatives_logic.get_user_organizations(
+            user["name"]
+        ).org_ids
+
+        helpers.call_action(
+            "organization_member_create",
+            id=owner_org["id"],
+            username=user["name"],
+            role="member",
+        )
+
+        assert owner_org["id"] in initiatives_logic.get_user_organizations(
+            user["name"]
+        ).org_ids
@@ -0,0 +1,86 @@
+# coding: utf8
+
+from __future__ import unicode_literals
+import json
+
+from flask import Blueprint, Response, request
+
+import ckan.logic
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+from ckan.common import c
+from ckanext.initiatives import invalidation, logic, warmup
+
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+initiatives = Blueprint("initiatives", __name__)
+
+
+@initiatives.before_app_request
+def _subscribe():
+    # in each worker process, once forked
+    invalidation.ensure_subscribed()
+    warmup.ensure_started()
+
+
+def _json_response(body, status=200):
+    return Response(json.dumps(body), status=status, mimetype="application/json")
+
+
+def check_access():
+    """
+    `initiatives_check_access` as a conditional GET: the response carries an
+    ETag derived from the decision version, and a client revalidating with
+    If-None-Match gets a 304 without the decision being evaluated again.
+
+    The version is read from the database (organizations' default policies
+    from the hierarchy cache, as the decision's are), so the decision it is
+    paired with is too: memberships are resolved afresh, not from the
+    membership cache or index, which may be behind it.
+    """
+    package_id = request.args.get("package_id")
+    resource_id = request.args.get("resource_id")
+
+    context = {
+        "model": model,
+        "user": c.user,
+        "auth_user_obj": c.userobj,
+    }
+    user_name = logic.initiatives_get_username_from_context(context)
+
+    version = None
+    if package_id and resource_id:
+        version = logic.initiatives_decision_version(
+            user_name, package_id, resource_id
+        )
+
+    if version is not None and version in request.if_none_match:
+        response = Response(status=304)
+    else:
+        try:
+            with logic.reference_evaluation():
+                result = toolkit.get_action("initiatives_check_access")(
+                    context, {"package_id": package_id, "resource_id": resource_id}
+                )
+        except ckan.logic.ValidationError as e:
+            return _json_response({"success": False, "error": e.error_dict}, 409)
+        except ckan.logic.NotFound:
+            return _json_response({"success": False, "error": "Not found"}, 404)
+        except ckan.logic.NotAuthorized:
+            return _json_response({"success": False, "error": "Not authorized"}, 403)
+        response = _json_response({"success": True, "result": result})
+
+    if version is not None:
+        response.set_etag(version)
+        # decisions are per-user: clients may keep them, shared caches may not,
+        # and they must always be revalidated
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+initiatives.add_url_rule(
+    "/api/initiatives/check_access", view_func=check_access, methods=["GET"]
+)
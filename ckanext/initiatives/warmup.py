@@ -0,0 +1,198 @@
+# coding: utf8
+
+from __future__ import unicode_literals
+import datetime
+import os
+import threading
+import timeit
+
+import ckan.model as model
+import ckan.plugins.toolkit as toolkit
+from ckanext.initiatives import cache, hierarchy, logic, membership_index
+
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+# config options
+#
+#   ckanext.initiatives.warmup                 warm the caches in a background
+#                                              thread when the app starts
+#                                              (default false)
+#   ckanext.initiatives.warmup.active_days     users active within this many
+#                                              days have their memberships
+#                                              resolved (default 7)
+#   ckanext.initiatives.warmup.users           at most this many of them, most
+#                                              recently active first
+#                                              (default 1000)
+
+WARMUP_PREFIX = "ckanext.initiatives.warmup"
+
+
+class WarmUp(object):
+    """
+    Loads the organization hierarchy, compiles every distinct policy string
+    and resolves the memberships of recently active users, recording what
+    each step did and how long it took
+    """
+
+    def __init__(self, active_days=7, max_users=1000):
+        self.active_days = active_days
+        self.max_users = max_users
+        self.state = "pending"
+        self.steps = []
+        self.error = None
+        self.pid = None
+        self._thread = None
+
+    def status(self):
+        return {
+            "state": self.state,
+            "finished": self.state == "finished",
+            # failures are logged, and only leave the caches cold
+            "ready": self.state in ("finished", "failed"),
+            "steps": list(self.steps),
+            "error": self.error,
+        }
+
+    def _step(self, name, fn):
+        start = timeit.default_timer()
+        result = fn()
+        self.steps.append(
+            dict(
+                result,
+                step=name,
+                seconds=round(timeit.default_timer() - start, 3),
+            )
+        )
+
+    def _organizations(self):
+        index = hierarchy.organizations.index()
+        return {"organizations": len(index.names)}
+
+    def _policies(self):
+        policies = set(
+            value
+            for (value,) in model.Session.query(model.PackageExtra.value)
+            .filter(model.PackageExtra.key == "resource_permissions")
+            .distinct()
+        )
+        policies.update(hierarchy.organizations.index().policies.values())
+        # packages without a policy of their own or a default
+        policies.add("")
+        for policy in policies:
+            logic.compile_resource_permissions(policy)
+        return {"policies": len(policies)}
+
+    def _memberships(self):
+        index = membership_index.memberships.index()
+        if index is not None:
+            return {"users": len(index.users), "source": "membership_index"}
+        if cache.memberships.ttl <= 0:
+            return {"users": 0, "skipped": "the membership cache is off"}
+
+        last_active = getattr(model.User, "last_active", None)
+        if last_active is None:
+            return {"users": 0, "skipped": "user activity is not recorded"}
+        since = datetime.datetime.utcnow() - datetime.timedelta(days=self.active_days)
+        users = (
+            model.Session.query(model.User.name)
+            .filter(model.User.state == "active")
+            .filter(last_active >= since)
+            .order_by(last_active.desc())
+            .limit(self.max_users)
+        )
+        count = 0
+        for (user_name,) in users:
+            logic.get_user_organizations(user_name)
+            count += 1
+        return {"users": count, "source": "membership_cache"}
+
+    def run(self):
+        self.state = "running"
+        try:
+            self._step("organization_hierarchy", self._organizations)
+            self._step("policies", self._policies)
+            self._step("memberships", self._memberships)
+        except Exception as e:
+            log.warning("cache warm-up failed", exc_info=True)
+            self.state = "failed"
+            self.error = str(e)
+        else:
+            log.info("cache warm-up finished: %s", self.steps)
+            self.state = "finished"
+        finally:
+            model.Session.remove()
+
+    def start(self, app=None):
+        def target():
+            if app is not None and hasattr(app, "app_context"):
+                with app.app_context():
+                    self.run()
+            else:
+                self.run()
+
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=target, name="initiatives-warmup")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+# the warm-up of this process, once started
+current = None
+_settings = None
+_lock = threading.Lock()
+
+
+def start(app, config):
+    """
+    start warming up in the background, if configured
+    """
+    global _settings
+
+    if not toolkit.asbool(config.get(WARMUP_PREFIX, False)):
+        return None
+    _settings = (
+        app,
+        int(config.get(WARMUP_PREFIX + ".active_days", 7)),
+        int(config.get(WARMUP_PREFIX + ".users", 1000)),
+    )
+    return ensure_started()
+
+
+def ensure_started():
+    """
+    the warm-up of this process, started once per process: a worker forked
+    after start() inherits its parent's warm-up but not the thread running
+    it, so it starts one of its own (on its first request)
+    """
+    global current
+
+    if _settings is None:
+        return None
+    if current is not None and current.pid == os.getpid():
+        return current
+    with _lock:
+        if current is None or current.pid != os.getpid():
+            app, active_days, max_users = _settings
+            current = WarmUp(active_days=active_days, max_users=max_users)
+            current.start(app)
+    return current
+
+
+def status():
+    ensure_started()
+    if current is None:
+        return {
+            "state": "disabled",
+            "finished": False,
+            "ready": True,
+            "steps": [],
+            "error": None,
+        }
+    return current.status()